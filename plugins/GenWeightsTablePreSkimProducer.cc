@@ -2,6 +2,9 @@
     Description: A producer to extract the generator weight from the GenEventInfoProduct and store it in the Runs tree.
     This is supposed to run at the beginning of the processing, before any skim or other processing is done.
     The weight is stored in a nanoaod::FlatTable, and the sum of weights is stored in a nanoaod::MergeableCounterTable.
+    With storeModelIndex, the model of each event is also stored as a single integer column genModelIndex, and the
+    index of each model label is stored in the Runs tree as genModelIndex_<label>. The index is a hash of the label,
+    so that it is the same in all jobs and files can be merged.
 
     Author: Christos Papageorgakis (borrowing heavily from the GenWeightsTableProducer.cc in PhysicsTools/NanoAOD/plugins
     https://github.com/cms-sw/cmssw/blob/a54a2a91c59f52c3cb7ed96da7551a71d53745bf/PhysicsTools/NanoAOD/plugins/GenWeightsTableProducer.cc)
@@ -23,16 +26,25 @@
 
 #include "boost/algorithm/string.hpp"
 
-class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::StreamCache<counters::CounterMap>,
+// Counters of a stream, together with the index of the active model label
+struct ModelCounterMap : counters::CounterMap {
+    int activeIndex = -1;
+};
+
+class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::StreamCache<ModelCounterMap>,
                                                                       edm::RunSummaryCache<counters::CounterMap>, 
                                                                       edm::EndRunProducer> {
     public:
         GenWeightsTablePreSkimProducer(edm::ParameterSet const& params)
         : genTag_(consumes<GenEventInfoProduct>(params.getParameter<edm::InputTag>("genEvent"))),
           genLumiInfoHeadTag_(
-            mayConsume<GenLumiInfoHeader, edm::InLumi>(params.getParameter<edm::InputTag>("genLumiInfoHeader"))) {
+            mayConsume<GenLumiInfoHeader, edm::InLumi>(params.getParameter<edm::InputTag>("genLumiInfoHeader"))),
+          storeModelIndex_(params.getParameter<bool>("storeModelIndex")) {
             produces<nanoaod::FlatTable>();
             produces<std::string>("genModel");
+            if (storeModelIndex_) {
+                produces<nanoaod::FlatTable>("genModelIndex");
+            }
             produces<nanoaod::MergeableCounterTable, edm::Transition::EndRun>();
         }
 
@@ -49,8 +61,21 @@ class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::Strea
         }
 
         // Initialize an empty counter map for each stream
-        std::unique_ptr<counters::CounterMap> beginStream(edm::StreamID) const override {
-            return std::make_unique<counters::CounterMap>();
+        std::unique_ptr<ModelCounterMap> beginStream(edm::StreamID) const override {
+            return std::make_unique<ModelCounterMap>();
+        }
+
+        // Index of a model label: a 31-bit FNV-1a hash, so that it does not depend on the order in which
+        // the labels are seen, and -1 for events without a label
+        static int modelIndex(const std::string& label) {
+            if (label.empty())
+                return -1;
+            uint32_t hash = 2166136261u;
+            for (unsigned char c : label) {
+                hash ^= c;
+                hash *= 16777619u;
+            }
+            return static_cast<int>(hash & 0x7fffffff);
         }
 
         void streamBeginLuminosityBlock(edm::StreamID id,
@@ -67,6 +92,7 @@ class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::Strea
                 boost::replace_all(label, "/", "_");
             }
             counterMap->setLabel(label);
+            counterMap->activeIndex = modelIndex(label);
         }
 
         // Produce the generator weight and store it in the stream counter map
@@ -84,6 +110,13 @@ class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::Strea
             std::string model_label = streamCache(id)->getLabel();
             auto outM = std::make_unique<std::string>((!model_label.empty()) ? std::string("GenModel_") + model_label : "");
             iEvent.put(std::move(outM), "genModel");
+
+            if (storeModelIndex_) {
+                auto outI = std::make_unique<nanoaod::FlatTable>(1, "genModelIndex", true);
+                outI->setDoc("index of the model label, see genModelIndex_<label> in the Runs tree");
+                outI->addColumnValue<int>("", streamCache(id)->activeIndex, "index of the model label", nanoaod::FlatTable::IntColumn);
+                iEvent.put(std::move(outI), "genModelIndex");
+            }
             
             counter->incGenOnly(weight);
             
@@ -114,6 +147,9 @@ class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::Strea
                 out->addInt("genEventCountPreSkim" + label, "event count" + doclabel, runCounter->num);
                 out->addFloat("genEventSumwPreSkim" + label, "sum of gen weights" + doclabel, runCounter->sumw);
                 out->addFloat("genEventSumw2PreSkim" + label, "sum of gen (weight^2)" + doclabel, runCounter->sumw2);
+                if (storeModelIndex_ && !x.first.empty()) {
+                    out->addInt("genModelIndex" + label, "value of genModelIndex" + doclabel, modelIndex(x.first));
+                }
             }
             iRun.put(std::move(out));
         }
@@ -124,12 +160,15 @@ class GenWeightsTablePreSkimProducer : public edm::global::EDProducer<edm::Strea
                 ->setComment("tag for the GenEventInfoProduct, to get the main weight");
             desc.add<edm::InputTag>("genLumiInfoHeader", edm::InputTag("generator"))
                 ->setComment("tag for the GenLumiInfoProduct, to get the model string");
+            desc.add<bool>("storeModelIndex", false)
+                ->setComment("also store the model of each event as an integer column genModelIndex");
             descriptions.add("genWeights", desc);
         }
 
     protected:
         const edm::EDGetTokenT<GenEventInfoProduct> genTag_;
         const edm::EDGetTokenT<GenLumiInfoHeader> genLumiInfoHeadTag_;
+        const bool storeModelIndex_;
 };
 
 #include "FWCore/Framework/interface/MakerMacros.h"
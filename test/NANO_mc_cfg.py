@@ -37,6 +37,14 @@ params.register(
     "Flag to indicate whether the verbose output is enabled",
 )
 
+params.register(
+    "storeModelIndex",
+    False,
+    VarParsing.multiplicity.singleton,
+    VarParsing.varType.bool,
+    "Store the model of each event as a single integer genModelIndex instead of one GenModel_<label> branch per model",
+)
+
 params.register(
     "isCRAB",
     False,
@@ -141,6 +149,7 @@ elif params.era == "2018":
 process.genWeightSum = cms.EDProducer(
     "GenWeightsTablePreSkimProducer",
     genEvent=cms.InputTag("generator"),
+    storeModelIndex=cms.bool(params.storeModelIndex),
 )
 process.genweight_step = cms.Path(process.genWeightSum)
 
@@ -149,6 +158,14 @@ process.NANOAODSIMoutput.outputCommands.extend(
         "keep nanoaodMergeableCounterTable_genWeightSum_*_*",
     ]
 )
+if params.storeModelIndex:
+    # Replace the GenModel_<label> branches by the genModelIndex column
+    process.NANOAODSIMoutput.outputCommands.extend(
+        [
+            "drop String_*_genModel_*",
+            "keep nanoaodFlatTable_genWeightSum_genModelIndex_*",
+        ]
+    )
 
 # HLT filter and skimmer
 if params.era == "2016apv" or params.era == "2016":
@@ -0,0 +1,210 @@
+"""
+Time haddnano.py and split_trees.py on synthetic SUEPNano files written with
+make_synthetic_nano.py, scanning the number of files, of extra branches and of
+models one at a time around a baseline. Run it from this directory:
+
+    python benchmark_merge_split.py --files 2 10 50 --models 1 10 100
+"""
+
+import argparse
+import collections
+import csv
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark merging and splitting on synthetic SUEPNano files"
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        nargs="+",
+        default=[2, 10],
+        help="Numbers of input files to scan. The first one is the baseline.",
+    )
+    parser.add_argument(
+        "--branches",
+        type=int,
+        nargs="+",
+        default=[0, 200],
+        help="Numbers of extra Events branches to scan. The first one is the baseline.",
+    )
+    parser.add_argument(
+        "--models",
+        type=int,
+        nargs="+",
+        default=[10, 100],
+        help="Numbers of models to scan. The first one is the baseline.",
+    )
+    parser.add_argument(
+        "--events", type=int, default=2000, help="Number of events per file"
+    )
+    parser.add_argument(
+        "--pfcands", type=float, default=300, help="Mean number of PF candidates"
+    )
+    parser.add_argument(
+        "--vary-models",
+        action="store_true",
+        help="Give each file a different subset of the models, so that merging has "
+        "to backfill branches",
+    )
+    parser.add_argument(
+        "--haddnano-options",
+        type=str,
+        default="--stream",
+        help="Options passed to haddnano.py",
+    )
+    parser.add_argument(
+        "--split-options", type=str, default="", help="Options passed to split_trees.py"
+    )
+    parser.add_argument(
+        "--skip-split", action="store_true", help="Only benchmark the merging"
+    )
+    parser.add_argument(
+        "--csv", type=str, default=None, help="Also write the results to a CSV file"
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        default=None,
+        help="Directory for the temporary files (default: a new temporary directory)",
+    )
+    return parser.parse_args()
+
+
+def run(cmd):
+    """Run a command, returning its wall time in seconds"""
+    start = time.time()
+    process = subprocess.Popen(
+        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    out, _ = process.communicate()
+    elapsed = time.time() - start
+    if process.returncode != 0:
+        print(out.decode("utf-8"))
+        raise RuntimeError("Command failed: {}".format(cmd))
+    return elapsed
+
+
+def get_size(paths):
+    """Total size of the files in MB"""
+    return sum(os.path.getsize(path) for path in paths) / 1000.0**2
+
+
+def benchmark_point(args, work_dir, n_files, n_branches, n_models):
+    """Generate one set of files and time merging and splitting them"""
+    point_dir = os.path.join(
+        work_dir, "f{}_b{}_m{}".format(n_files, n_branches, n_models)
+    )
+    input_dir = os.path.join(point_dir, "input")
+    run(
+        "python make_synthetic_nano.py -o {} --files {} --events {} --models {} "
+        "--extra-branches {} --pfcands {}{}".format(
+            input_dir,
+            n_files,
+            args.events,
+            n_models,
+            n_branches,
+            args.pfcands,
+            " --vary-models" if args.vary_models else "",
+        )
+    )
+    inputs = sorted(glob.glob(os.path.join(input_dir, "*.root")))
+    input_size = get_size(inputs)
+    n_events = n_files * args.events
+
+    result = collections.OrderedDict()
+    result["files"] = n_files
+    result["branches"] = n_branches
+    result["models"] = n_models
+    result["events"] = n_events
+    result["size_mb"] = round(input_size, 1)
+
+    merged = os.path.join(point_dir, "merged.root")
+    merge_time = run(
+        "python haddnano.py {} {} {}".format(
+            args.haddnano_options, merged, " ".join(inputs)
+        )
+    )
+    result["merge_s"] = round(merge_time, 2)
+    result["merge_mb_s"] = round(input_size / merge_time, 1)
+    result["merge_evt_s"] = int(n_events / merge_time)
+
+    if not args.skip_split:
+        split_dir = os.path.join(point_dir, "split")
+        split_time = run(
+            "python split_trees.py -i {} -o {} {}".format(
+                input_dir, split_dir, args.split_options
+            )
+        )
+        result["split_s"] = round(split_time, 2)
+        result["split_mb_s"] = round(input_size / split_time, 1)
+        result["split_evt_s"] = int(n_events / split_time)
+
+    shutil.rmtree(point_dir)
+    return result
+
+
+def get_points(args):
+    """Scan each dimension on its own, keeping the others at the baseline"""
+    base = (args.files[0], args.branches[0], args.models[0])
+    points = [base]
+    for n_files in args.files[1:]:
+        points.append((n_files, base[1], base[2]))
+    for n_branches in args.branches[1:]:
+        points.append((base[0], n_branches, base[2]))
+    for n_models in args.models[1:]:
+        points.append((base[0], base[1], n_models))
+    return points
+
+
+def print_table(results):
+    columns = list(results[0].keys())
+    print(" ".join("{:>12}".format(column) for column in columns))
+    for result in results:
+        print(" ".join("{:>12}".format(result[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    for script in [
+        "make_synthetic_nano.py",
+        "haddnano.py",
+        "nano_trees.py",
+        "split_trees.py",
+    ]:
+        if not os.path.exists(script):
+            print("Please make sure {} is in the current directory".format(script))
+            sys.exit(1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="suepnano_benchmark_")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    results = []
+    for n_files, n_branches, n_models in get_points(args):
+        print(
+            "Benchmarking {} files, {} extra branches, {} models".format(
+                n_files, n_branches, n_models
+            )
+        )
+        results.append(benchmark_point(args, work_dir, n_files, n_branches, n_models))
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+
+    print_table(results)
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
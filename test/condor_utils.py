@@ -0,0 +1,455 @@
+"""
+Helpers to plan condor jobs, shared by merge.py, splitter.py and
+resubmit_to_condor.py.
+"""
+
+import fnmatch
+import hashlib
+import heapq
+import math
+import os
+import subprocess
+import sys
+
+PACKING_MODES = ("balanced", "greedy")
+
+
+def add_packing_arguments(parser):
+    """Add the options of group_files to the parser of a script"""
+    parser.add_argument(
+        "--packing",
+        type=str,
+        choices=PACKING_MODES,
+        default="balanced",
+        help="How files are grouped into jobs: 'balanced' spreads them over as few "
+        "groups of about equal size as fit under --max_size, 'greedy' fills the "
+        "groups one after the other in listing order",
+    )
+    parser.add_argument(
+        "--min_fill",
+        type=float,
+        default=0.5,
+        help="With --packing balanced, groups below this fraction of --max_size "
+        "are spread over the other groups when they fit",
+    )
+
+
+def group_files_greedy(files, sizes, max_size):
+    """Split files into groups based on size, filling one group after the other"""
+    groups = []
+    current_group = []
+    current_size = 0
+
+    for f in files:
+        size = sizes[f]
+        if current_size + size > max_size and current_group:
+            groups.append(current_group)
+            current_group = []
+            current_size = 0
+        current_group.append(f)
+        current_size += size
+
+    if current_group:
+        groups.append(current_group)
+
+    return groups
+
+
+def pack_files(files, sizes, n_groups):
+    """
+    Spread the files over n_groups groups, from the largest to the smallest file,
+    each to the group that is the emptiest so far
+    """
+    groups = [[] for _ in range(n_groups)]
+    heap = [(0, i) for i in range(n_groups)]
+    for f in files:
+        size, i = heapq.heappop(heap)
+        groups[i].append(f)
+        heapq.heappush(heap, (size + sizes[f], i))
+    return groups
+
+
+def group_files_balanced(files, sizes, max_size, min_fill=0.5):
+    """
+    Split files into groups of about equal size below max_size. The files are
+    packed taking them from the largest to the smallest and giving each to the
+    emptiest group, into the smallest number of groups, found by bisection, for
+    which no group is above max_size. Files larger than max_size get a group of
+    their own. Groups below min_fill * max_size are then emptied into the others
+    if their files fit. Each group keeps the files in listing order.
+    """
+    order = dict((f, i) for i, f in enumerate(files))
+    large = [f for f in files if sizes[f] > max_size]
+    files = sorted(
+        [f for f in files if sizes[f] <= max_size], key=lambda f: (-sizes[f], order[f])
+    )
+
+    def fits(groups):
+        return all(sum(sizes[f] for f in group) <= max_size for group in groups)
+
+    # At least enough groups for the total size, and one for each file above half
+    # of max_size. Filling the groups one after the other always fits.
+    groups = group_files_greedy(files, sizes, max_size)
+    n_min = max(
+        int(math.ceil(sum(sizes[f] for f in files) / float(max_size))),
+        len([f for f in files if 2 * sizes[f] > max_size]),
+    )
+    n_max = len(groups)
+    packed = pack_files(files, sizes, n_max)
+    if fits(packed):
+        groups = packed
+    while n_min < n_max:
+        n_groups = (n_min + n_max) // 2
+        packed = pack_files(files, sizes, n_groups)
+        if fits(packed):
+            groups = packed
+            n_max = n_groups
+        else:
+            n_min = n_groups + 1
+    groups += [[f] for f in large]
+
+    totals = [sum(sizes[f] for f in group) for group in groups]
+    for i in sorted(range(len(groups)), key=lambda i: totals[i]):
+        if not groups[i] or totals[i] >= min_fill * max_size:
+            continue
+        trial = list(totals)
+        moves = []
+        for f in sorted(groups[i], key=lambda f: -sizes[f]):
+            room = [
+                j
+                for j in range(len(groups))
+                if j != i and groups[j] and trial[j] + sizes[f] <= max_size
+            ]
+            if not room:
+                break
+            j = min(room, key=lambda j: trial[j])
+            trial[j] += sizes[f]
+            moves.append((f, j))
+        else:
+            for f, j in moves:
+                groups[j].append(f)
+            groups[i] = []
+            trial[i] = 0
+            totals = trial
+
+    groups = [sorted(group, key=order.get) for group in groups if group]
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def group_files(files, sizes, max_size, packing="balanced", min_fill=0.5):
+    """Split files into groups of at most max_size, as set by --packing"""
+    if not files:
+        return []
+    if packing == "greedy":
+        return group_files_greedy(files, sizes, max_size)
+    return group_files_balanced(files, sizes, max_size, min_fill)
+
+
+# Compressions of the CMSSW tarball: (extension, compressors to try in order).
+# The workers unpack it with the tar of rhel7, which only detects these.
+TARBALL_COMPRESSIONS = {
+    "gzip": (".tar.gz", ["pigz", "gzip"]),
+    "xz": (".tar.xz", ["xz -T0"]),
+    "none": (".tar", []),
+}
+
+# Names left out of the CMSSW tarball: version control, job outputs, the tarballs
+# themselves and the work directories of the condor scripts
+TARBALL_EXCLUDES = (
+    ".git",
+    ".gitignore",
+    ".gitattributes",
+    ".gitmodules",
+    ".svn",
+    ".hg",
+    "CVS",
+    "tmp",
+    "__pycache__",
+    "*.pyc",
+    "*.root",
+    "*.tar",
+    "*.tar.*",
+    "condor_merge_*",
+    "condor_split_*",
+    "condor_resubmit_*",
+)
+
+
+def add_tarball_arguments(parser):
+    """Add the options of create_cmssw_tarball to the parser of a script"""
+    parser.add_argument(
+        "--tarball_compression",
+        type=str,
+        choices=sorted(TARBALL_COMPRESSIONS),
+        default="gzip",
+        help="Compression of the CMSSW tarball. gzip uses pigz when it is "
+        "installed, xz makes a smaller tarball and none is the fastest to make.",
+    )
+    parser.add_argument(
+        "--rebuild_tarball",
+        action="store_true",
+        help="Rebuild the CMSSW tarball even if the CMSSW area did not change",
+    )
+
+
+def get_tarball_name(cmssw_version, compression="gzip", excludes=()):
+    """
+    Name of the CMSSW tarball, in the current directory. Tarballs made with
+    different excludes get different names, so that they do not replace each
+    other.
+    """
+    name = cmssw_version
+    if excludes:
+        name += "_no_" + "_".join(sorted(excludes))
+    return name + TARBALL_COMPRESSIONS[compression][0]
+
+
+def find_executable(name):
+    """Path of a command found in the PATH, or None"""
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def list_tarball_members(cmssw_base, excludes=()):
+    """
+    Paths below the parent of CMSSW_BASE that go into the tarball, directories
+    included, skipping the names in TARBALL_EXCLUDES and in excludes, and the
+    directories tagged with a CACHEDIR.TAG
+    """
+    top = os.path.dirname(cmssw_base)
+    patterns = TARBALL_EXCLUDES + tuple(excludes)
+    members = []
+    for root, directories, files in os.walk(cmssw_base):
+        if "CACHEDIR.TAG" in files:
+            directories[:] = []
+            continue
+        members.append(os.path.relpath(root, top))
+        directories[:] = sorted(
+            d
+            for d in directories
+            if not any(fnmatch.fnmatch(d, pattern) for pattern in patterns)
+        )
+        # Symbolic links to directories are archived as links, not followed
+        names = [d for d in directories if os.path.islink(os.path.join(root, d))]
+        directories[:] = [d for d in directories if d not in names]
+        names += [
+            f
+            for f in files
+            if not any(fnmatch.fnmatch(f, pattern) for pattern in patterns)
+        ]
+        members.extend(
+            os.path.relpath(os.path.join(root, n), top) for n in sorted(names)
+        )
+    return members
+
+
+def hash_tarball_members(top, members):
+    """
+    Hash of the paths, sizes, modification times and link targets of the
+    members, so that any change to the files that go into the tarball changes it
+    """
+    digest = hashlib.sha1()
+    for member in members:
+        path = os.path.join(top, member)
+        stat = os.lstat(path)
+        target = os.readlink(path) if os.path.islink(path) else ""
+        digest.update(
+            "{}\0{}\0{}\0{}\n".format(
+                member, stat.st_size, int(stat.st_mtime), target
+            ).encode("utf-8")
+        )
+    return digest.hexdigest()
+
+
+def create_cmssw_tarball(compression="gzip", rebuild=False, excludes=()):
+    """
+    Create a tarball of the current CMSSW environment, or reuse the one in the
+    current directory if the files that go into it did not change since it was
+    made. The hash of the file tree is kept in <tarball>.hash next to it. Names
+    matching one of excludes are left out, like those in TARBALL_EXCLUDES.
+    """
+    if not "CMSSW_BASE" in os.environ:
+        print("Please run cmsenv in your CMSSW environment first")
+        sys.exit(1)
+
+    cmssw_base = os.path.realpath(os.environ["CMSSW_BASE"])
+    cmssw_version = os.path.basename(cmssw_base)
+    tarball = get_tarball_name(cmssw_version, compression, excludes)
+    hash_file = tarball + ".hash"
+
+    members = list_tarball_members(cmssw_base, excludes)
+    tree_hash = hash_tarball_members(os.path.dirname(cmssw_base), members)
+    if not rebuild and os.path.exists(tarball) and os.path.exists(hash_file):
+        with open(hash_file, "r") as f:
+            if f.read().strip() == tree_hash:
+                print(
+                    "Reusing CMSSW tarball {}, {} is unchanged".format(
+                        tarball, cmssw_version
+                    )
+                )
+                return tarball, cmssw_version
+
+    compressor = None
+    for command in TARBALL_COMPRESSIONS[compression][1]:
+        if find_executable(command.split()[0]):
+            compressor = command
+            break
+    if compressor is None and TARBALL_COMPRESSIONS[compression][1]:
+        print("Cannot find {} to compress the CMSSW tarball".format(compression))
+        sys.exit(1)
+
+    print(
+        "Creating CMSSW tarball with {} ({} files and directories)...".format(
+            compressor.split()[0] if compressor else "no compression", len(members)
+        )
+    )
+    # The list of members is written out so that tar archives exactly what was
+    # hashed. The new tarball replaces the old one only once it is complete.
+    list_file = tarball + ".files"
+    with open(list_file, "w") as f:
+        for member in members:
+            f.write(member + "\0")
+    cmd = ["tar", "--no-recursion"]
+    if compressor:
+        cmd += ["--use-compress-program", compressor]
+    cmd += [
+        "-cf",
+        os.path.abspath(tarball + ".tmp"),
+        "-C",
+        os.path.dirname(cmssw_base),
+        "--null",
+        "-T",
+        os.path.abspath(list_file),
+    ]
+    try:
+        subprocess.check_call(cmd)
+    finally:
+        os.remove(list_file)
+    os.rename(tarball + ".tmp", tarball)
+    with open(hash_file, "w") as f:
+        f.write(tree_hash + "\n")
+    print(
+        "Created CMSSW tarball: {} of size {} MB".format(
+            tarball, round(os.path.getsize(tarball) / 1000.0**2, 1)
+        )
+    )
+    return tarball, cmssw_version
+
+
+# What the merge and split jobs get to run their scripts: "minimal" sets up the
+# CMSSW release from CVMFS, "cmssw" unpacks a tarball of the whole CMSSW area
+SANDBOX_MODES = ("minimal", "cmssw")
+
+# Environment of the minimal sandbox, sourced by the jobs
+SETUP_ENV_SCRIPT = """#!/bin/bash
+# Environment of {cmssw_version} from CVMFS, without a CMSSW area
+source /cvmfs/cms.cern.ch/cmsset_default.sh
+export SCRAM_ARCH={scram_arch}
+cd {release_base}/src
+eval $(scramv1 runtime -sh) # cmsenv is an alias not on the workers
+cd - > /dev/null
+"""
+
+
+def add_sandbox_arguments(parser):
+    """Add the options of create_sandbox to the parser of a script"""
+    parser.add_argument(
+        "--sandbox",
+        type=str,
+        choices=SANDBOX_MODES,
+        default="minimal",
+        help="'minimal' only sends the scripts to the jobs and sets up the CMSSW "
+        "release from CVMFS, 'cmssw' sends a tarball of the whole CMSSW area, "
+        "e.g. if the scripts need packages built in it",
+    )
+    add_tarball_arguments(parser)
+
+
+class Sandbox(object):
+    """The files sent to the jobs of one type and how the jobs set them up"""
+
+    def __init__(self, mode, files, cmssw_version, cmssw_tarball=None):
+        self.mode = mode
+        # Files to transfer with every job, besides its own inputs
+        self.files = files
+        self.cmssw_version = cmssw_version
+        self.cmssw_tarball = cmssw_tarball
+
+    def setup_commands(self, inputs):
+        """
+        Commands of the job script that set up the environment in a new
+        directory and move there the transferred files and the inputs of the job
+        (file names, which can use shell variables)
+        """
+        names = [os.path.basename(f) for f in self.files if f != self.cmssw_tarball]
+        moved = " ".join("../" + name for name in names + list(inputs))
+        if self.mode == "minimal":
+            return """# Move to a tmp dir to avoid conflicts
+tmp_dir=$(mktemp -d -p .)
+cd $tmp_dir
+mv {moved} .
+source setup_env.sh""".format(
+                moved=moved
+            )
+        return """# Move to a tmp dir to avoid conflicts
+tmp_dir=$(mktemp -d -p .)
+cd $tmp_dir
+tar -xf ../{cmssw_tarball}
+rm ../{cmssw_tarball}
+export SCRAM_ARCH=slc7_amd64_gcc700
+if [ ! -d {cmssw_version}/src ]; then
+    mkdir -p {cmssw_version}/src
+fi
+mv {moved} {cmssw_version}/src
+cd {cmssw_version}/src
+eval $(scramv1 runtime -sh) # cmsenv is an alias not on the workers""".format(
+            cmssw_tarball=self.cmssw_tarball,
+            cmssw_version=self.cmssw_version,
+            moved=moved,
+        )
+
+
+def create_sandbox(args, work_dir, scripts, excludes=()):
+    """
+    Prepare what every job needs besides its inputs: the scripts it runs and,
+    with --sandbox minimal, setup_env.sh written in work_dir, or with --sandbox
+    cmssw, the tarball of the CMSSW area without the names in excludes
+    """
+    if not "CMSSW_BASE" in os.environ:
+        print("Please run cmsenv in your CMSSW environment first")
+        sys.exit(1)
+
+    if args.sandbox == "cmssw":
+        cmssw_tarball, cmssw_version = create_cmssw_tarball(
+            args.tarball_compression, args.rebuild_tarball, excludes
+        )
+        return Sandbox(
+            args.sandbox,
+            list(scripts) + [cmssw_tarball],
+            cmssw_version,
+            cmssw_tarball,
+        )
+
+    cmssw_version = os.path.basename(os.environ["CMSSW_BASE"])
+    release_base = os.environ.get("CMSSW_RELEASE_BASE", "")
+    if not release_base.startswith("/cvmfs/"):
+        print(
+            "The release of {} is not on CVMFS, please use --sandbox cmssw".format(
+                cmssw_version
+            )
+        )
+        sys.exit(1)
+    setup_env = os.path.join(work_dir, "setup_env.sh")
+    with open(setup_env, "w") as f:
+        f.write(
+            SETUP_ENV_SCRIPT.format(
+                cmssw_version=cmssw_version,
+                scram_arch=os.environ["SCRAM_ARCH"],
+                release_base=release_base,
+            )
+        )
+    os.chmod(setup_env, 0o755)
+    return Sandbox(args.sandbox, list(scripts) + [setup_env], cmssw_version)
@@ -1,37 +1,293 @@
 import ROOT  # type: ignore [import]
+import argparse
+import collections
+import multiprocessing
 import numpy
+import os
+import shutil
 import sys
+import tempfile
+import time
+from nano_trees import BRANCH_TYPES, read_runs, write_runs_tree
 
+# Compression algorithm codes used in ROOT compression settings (100 * algorithm + level)
+COMPRESSION_ALGORITHMS = {"ZLIB": 1, "LZMA": 2, "LZ4": 4, "ZSTD": 5}
+DEFAULT_COMPRESSION_LEVELS = {"ZLIB": 1, "LZMA": 9, "LZ4": 4, "ZSTD": 5}
 
-def zero_fill(tree, br_name, br_obj, allow_non_bool=False):
-    # typename: (numpy type code, root type code)
-    branch_type_dict = {
-        "Bool_t": ("?", "O"),
-        "Float_t": ("f4", "F"),
-        "UInt_t": ("u4", "i"),
-        "Long64_t": ("i8", "L"),
-        "Double_t": ("f8", "D"),
+
+def compression_setting(value):
+    """Parse ALGORITHM[:LEVEL], e.g. ZSTD:5, or a plain ROOT compression setting"""
+    if value.isdigit():
+        return int(value)
+    algorithm, _, level = value.upper().partition(":")
+    if algorithm not in COMPRESSION_ALGORITHMS:
+        raise argparse.ArgumentTypeError(
+            "Unknown compression algorithm %s, use one of %s"
+            % (algorithm, ", ".join(sorted(COMPRESSION_ALGORITHMS)))
+        )
+    level = int(level) if level else DEFAULT_COMPRESSION_LEVELS[algorithm]
+    return 100 * COMPRESSION_ALGORITHMS[algorithm] + level
+
+
+def tree_setting(value):
+    """Parse [TREE=]VALUE, where a missing tree name applies the value to all trees"""
+    tree, _, number = value.rpartition("=")
+    return tree or "*", int(number)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Merge NanoAOD files, backfilling branches missing from some inputs"
+    )
+    parser.add_argument("output", type=str, help="Output file name")
+    parser.add_argument("inputs", type=str, nargs="+", help="Input files to merge")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Open each input file only while it is being merged instead of keeping "
+        "all of them open for the whole merge. Use this for merges with many inputs.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to use. With more than one, disjoint subsets of the "
+        "inputs are merged in parallel (streaming through them) and the partial "
+        "outputs are then merged together.",
+    )
+    parser.add_argument(
+        "--fan-in",
+        type=int,
+        default=8,
+        help="Maximum number of partial outputs merged together in one step when "
+        "running with --jobs",
+    )
+    parser.add_argument(
+        "--reduce-runs",
+        action="store_true",
+        help="Write one Runs entry per run, summing the event counts and sums of "
+        "weights of the merged entries, instead of one entry per input job",
+    )
+    parser.add_argument(
+        "--compression",
+        type=compression_setting,
+        default=None,
+        help="Compression of the output file as ALGORITHM[:LEVEL] with ALGORITHM one "
+        "of ZSTD, LZ4, LZMA or ZLIB, e.g. ZSTD:5. By default the compression of the "
+        "inputs is kept if they all agree, and ROOT's default is used otherwise.",
+    )
+    parser.add_argument(
+        "--auto-flush",
+        type=tree_setting,
+        action="append",
+        default=[],
+        help="Auto-flush setting of the output trees as [TREE=]VALUE, in entries if "
+        "positive or in bytes if negative, like TTree::SetAutoFlush. Can be repeated "
+        "to set different values per tree, e.g. --auto-flush Events=-30000000.",
+    )
+    parser.add_argument(
+        "--basket-size",
+        type=tree_setting,
+        action="append",
+        default=[],
+        help="Basket size in bytes of the output trees as [TREE=]VALUE. Can be "
+        "repeated to set different values per tree.",
+    )
+    parser.add_argument(
+        "--max-output-size",
+        type=float,
+        default=None,
+        help="Target size of the outputs in GB. When the output reaches it, the merge "
+        "continues in a new file: out_part0.root, out_part1.root, etc. (with out.root "
+        "the output name given). Cannot be used with --jobs.",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Print the compression ratio of the output trees together with the time "
+        "it took to write them and to read them back",
+    )
+    return parser.parse_args()
+
+
+# Trees whose branches can differ between inputs and need to be backfilled
+BACKFILLED_TREES = ("Events", "Runs")
+
+# Smallest and largest basket of a backfilled branch, in bytes
+MIN_FILL_BASKET_SIZE = 1000
+MAX_FILL_BASKET_SIZE = 1000**3
+
+# Runs branches with counters that are added up when reducing Runs entries,
+# e.g. genEventCount, genEventSumw2 and the genEventSumwPreSkim_<model> ones
+SUMMED_RUNS_BRANCHES = ("genEventCount", "genEventSumw")
+
+# Runs branches that NanoAOD stores divided by the sum of weights
+WEIGHTED_RUNS_BRANCHES = ("LHEScaleSumw", "LHEPdfSumw", "PSSumw")
+
+# Runs branches with a label that is the same in all entries, or 0 in the entries
+# of inputs where it was backfilled, e.g. genModelIndex_<model>
+LABEL_RUNS_BRANCHES = ("genModelIndex_",)
+
+# Reading back the output for the report, without python in the loop
+ROOT.gInterpreter.Declare(
+    """
+Long64_t haddnano_read(TTree* tree) {
+    Long64_t n_bytes = 0;
+    for (Long64_t i = 0; i < tree->GetEntries(); ++i) n_bytes += tree->GetEntry(i);
+    return n_bytes;
+}
+"""
+)
+
+# Filling entry by entry from python dominates the merge time when many branches
+# need to be backfilled, so the loop runs in C++ instead.
+ROOT.gInterpreter.Declare(
+    """
+void haddnano_fill(TBranch* branch, TBranch* counter, Long64_t n_entries) {
+    // Fill the branch n_entries times with the contents of its buffer. For
+    // variable length arrays the counter branch is read first, so that each
+    // entry gets as many elements as the counter says.
+    for (Long64_t i = 0; i < n_entries; ++i) {
+        if (counter) counter->GetEntry(i);
+        branch->Fill();
     }
-    brType = br_obj.GetLeaf(br_name).GetTypeName()
-    if (not allow_non_bool) and (brType != "Bool_t"):
-        print(
-            (
-                "Did not expect to back fill non-boolean branches",
-                tree,
-                br_name,
-                br_obj.GetLeaf(br).GetTypeName(),
+}
+
+Long64_t haddnano_sum(TBranch* counter, Long64_t n_entries) {
+    // Sum of a counter branch over the first n_entries, with its address set
+    TLeaf* leaf = (TLeaf*)counter->GetListOfLeaves()->At(0);
+    Long64_t sum = 0;
+    for (Long64_t i = 0; i < n_entries; ++i) {
+        counter->GetEntry(i);
+        sum += (Long64_t)leaf->GetValue();
+    }
+    return sum;
+}
+"""
+)
+
+
+def get_max_fill_basket_size(tree):
+    """
+    Largest basket of a branch backfilled in the tree: the largest basket of its
+    other branches. The trees of read-only inputs cannot write baskets to their
+    file, so their backfilled branches are kept whole in one basket (None).
+    """
+    file_handle = tree.GetCurrentFile()
+    if file_handle and not file_handle.IsWritable():
+        return None
+    return max(
+        [MIN_FILL_BASKET_SIZE]
+        + [branch.GetBasketSize() for branch in tree.GetListOfBranches()]
+    )
+
+
+def get_fill_basket_size(n_bytes, max_basket_size):
+    """Basket size for n_bytes of backfilled values, within the allowed range"""
+    size = n_bytes + MIN_FILL_BASKET_SIZE
+    if max_basket_size is not None:
+        size = min(size, max_basket_size)
+    return int(min(size, MAX_FILL_BASKET_SIZE))
+
+
+def zero_fill(tree, br_name, schema, max_basket_size=None):
+    """
+    Add the branch br_name to the tree, as described in the schema, and fill it
+    with zeros for all the entries already in the tree. Variable length arrays
+    get zero elements per entry if their counter branch is missing too, or as
+    many zeros as the counter says otherwise. The baskets are sized for the
+    values filled, up to max_basket_size (see get_max_fill_basket_size).
+    """
+    if tree.GetListOfBranches().FindObject(br_name):
+        # Already added as the counter of another branch
+        return
+    brType, length, count_name, max_len = schema[br_name]
+    if brType not in BRANCH_TYPES:
+        print("Cannot backfill branch %s of type %s, skipping it" % (br_name, brType))
+        return
+    dtype = numpy.dtype(BRANCH_TYPES[brType][0])
+    n_entries = tree.GetEntries()
+
+    counter = None
+    counter_buff = None
+    n_values = n_entries
+    if count_name:
+        if not tree.GetListOfBranches().FindObject(count_name):
+            # The whole collection is missing: fill the counter with zeros
+            # first and keep its buffer attached while filling the array
+            count_type = BRANCH_TYPES[schema[count_name][0]]
+            counter_buff = numpy.zeros(1, dtype=numpy.dtype(count_type[0]))
+            b = tree.Branch(count_name, counter_buff, count_name + "/" + count_type[1])
+            b.SetBasketSize(
+                get_fill_basket_size(n_entries * counter_buff.itemsize, max_basket_size)
             )
-        )
+            ROOT.haddnano_fill(b, ROOT.nullptr, n_entries)
+            n_values = 0
+        else:
+            # Only this member of the collection is missing: read the counter
+            # for every entry
+            counter = tree.GetBranch(count_name)
+            tree_count = counter.GetLeaf(count_name)
+            counter_buff = numpy.zeros(
+                1, dtype=numpy.dtype(BRANCH_TYPES[tree_count.GetTypeName()][0])
+            )
+            counter.SetAddress(counter_buff)
+            max_len = max(max_len, tree_count.GetMaximum())
+            n_values = ROOT.haddnano_sum(counter, n_entries)
+        max_len = max(1, max_len)
+        leaflist = "%s[%s]/%s" % (br_name, count_name, BRANCH_TYPES[brType][1])
+    elif length > 1:
+        max_len = length
+        n_values = n_entries * length
+        leaflist = "%s[%d]/%s" % (br_name, max_len, BRANCH_TYPES[brType][1])
     else:
-        if brType not in branch_type_dict:
-            raise RuntimeError("Impossible to backfill branch of type %s" % brType)
-        buff = numpy.zeros(1, dtype=numpy.dtype(branch_type_dict[brType][0]))
-        b = tree.Branch(br_name, buff, br_name + "/" + branch_type_dict[brType][1])
-        # be sure we do not trigger flushing
-        b.SetBasketSize(tree.GetEntries() * 2)
-        for x in range(0, tree.GetEntries()):
-            b.Fill()
-        b.ResetAddress()
+        max_len = 1
+        leaflist = "%s/%s" % (br_name, BRANCH_TYPES[brType][1])
+
+    buff = numpy.zeros(max_len, dtype=dtype)
+    b = tree.Branch(br_name, buff, leaflist)
+    # Sized for the values actually filled, with the offsets of variable length
+    # arrays, so that a missing collection does not allocate its maximum length
+    n_bytes = n_values * dtype.itemsize + (n_entries * 4 if count_name else 0)
+    b.SetBasketSize(get_fill_basket_size(n_bytes, max_basket_size))
+    ROOT.haddnano_fill(b, counter if counter else ROOT.nullptr, n_entries)
+    b.ResetAddress()
+    if counter_buff is not None:
+        tree.GetBranch(count_name).ResetAddress()
+
+
+def update_schema(schemas, file_handle):
+    """
+    Add the branches of the Events and Runs trees of one file to the union
+    schemas. Only the tree headers are read, no baskets. Each branch is
+    described by (type name, fixed length, counter branch name, maximum length
+    seen for variable length arrays).
+    """
+    for name in BACKFILLED_TREES:
+        key = file_handle.GetListOfKeys().FindObject(name)
+        if not key:
+            continue
+        schema = schemas.setdefault(name, collections.OrderedDict())
+        for br in key.ReadObj().GetListOfBranches():
+            br_name = br.GetName()
+            leaf = br.GetLeaf(br_name)
+            if not leaf:
+                leaf = br.GetListOfLeaves().At(0)
+            leaf_count = leaf.GetLeafCount()
+            if leaf_count:
+                desc = (
+                    leaf.GetTypeName(),
+                    1,
+                    leaf_count.GetName(),
+                    leaf_count.GetMaximum(),
+                )
+            else:
+                desc = (leaf.GetTypeName(), leaf.GetLen(), None, 0)
+            if br_name in schema:
+                desc = desc[:3] + (max(desc[3], schema[br_name][3]),)
+            schema[br_name] = desc
+    return schemas
 
 
 def open_files(input_files):
@@ -54,103 +310,443 @@ def open_files(input_files):
     return file_handles, go_fast
 
 
+def scan_files(input_files):
+    """
+    Open each input file once, only to check that it is readable, to compare
+    its compression settings and to build the union schema of the trees that
+    get backfilled, and close it again right away.
+    """
+    valid_files = []
+    go_fast = True
+    compression = None
+    schemas = {}
+
+    for input_file in input_files:
+        file_handle = ROOT.TFile.Open(input_file)
+        if not file_handle or file_handle.IsZombie():
+            print("Error opening file %s" % input_file)
+            continue
+        valid_files.append(input_file)
+        if compression is None:
+            compression = file_handle.GetCompressionSettings()
+        elif go_fast and file_handle.GetCompressionSettings() != compression:
+            go_fast = False
+            print("Disabling fast merging as inputs have different compressions")
+        update_schema(schemas, file_handle)
+        file_handle.Close()
+    return valid_files, go_fast, compression, schemas
+
+
+def stream_files(input_files):
+    """
+    Yield the input files one at a time. Each file is closed as soon as the
+    caller asks for the next one, so only one input is open at any time.
+    """
+    for input_file in input_files:
+        print("Adding file" + str(input_file))
+        file_handle = ROOT.TFile.Open(input_file)
+        if not file_handle or file_handle.IsZombie():
+            print("Error opening file %s" % input_file)
+            continue
+        yield file_handle
+        file_handle.Close()
+
+
+def backfill(tree, schema):
+    """
+    Zero fill the branches of the union schema that are missing from a tree,
+    so that every tree is backfilled once against the final set of branches.
+    """
+    missing_branches = [br for br in schema if not tree.GetBranch(br)]
+    if not missing_branches:
+        return
+    print("missing: " + str(missing_branches))
+    max_basket_size = get_max_fill_basket_size(tree)
+    for br in missing_branches:
+        zero_fill(tree, br, schema, max_basket_size)
+
+
+def reduce_runs(tree):
+    """
+    Return a copy of the Runs tree with a single entry per run. Event counts and
+    sums of weights are added up, arrays that NanoAOD stores divided by the sum
+    of weights (e.g. LHEScaleSumw) are averaged weighted by the corresponding
+    genEventSumw, labels such as genModelIndex_<model> keep their non-zero
+    value and every other branch keeps the value of the first entry of the run.
+    The copy is created in the current directory.
+    """
+    runs_in = read_runs(tree)
+    n_entries = tree.GetEntries()
+    entries_per_run = collections.OrderedDict()
+    for i, values in enumerate(runs_in["run"][3]):
+        entries_per_run.setdefault(int(values[0]), []).append(i)
+
+    runs = collections.OrderedDict(
+        (name, (type_name, count, length, []))
+        for name, (type_name, count, length, _) in runs_in.items()
+    )
+    for entries in entries_per_run.values():
+        for name, (_, _, _, values) in runs_in.items():
+            first = values[entries[0]]
+            weight_name = weighted_runs_branch(name)
+            if weight_name and weight_name in runs_in:
+                weights = [runs_in[weight_name][3][i][0] for i in entries]
+                total = sum(weights)
+                if total:
+                    first = [
+                        sum(values[i][j] * w for i, w in zip(entries, weights)) / total
+                        for j in range(len(first))
+                    ]
+            elif name.startswith(SUMMED_RUNS_BRANCHES):
+                first = [sum(values[i][j] for i in entries) for j in range(len(first))]
+            elif name.startswith(LABEL_RUNS_BRANCHES):
+                first = [max(values[i][0] for i in entries)]
+            runs[name][3].append(list(first))
+    print("Reduced {} Runs entries to {}".format(n_entries, len(entries_per_run)))
+
+    plan = [
+        (br.GetName(), br.GetName(), br.GetTitle()) for br in tree.GetListOfBranches()
+    ]
+    return write_runs_tree(runs, plan)
+
+
+def weighted_runs_branch(name):
+    """
+    Name of the sum of weights a Runs branch is normalized to, or None if the
+    branch is not stored divided by a sum of weights
+    """
+    for prefix in WEIGHTED_RUNS_BRANCHES:
+        if name.startswith(prefix):
+            return "genEventSumw" + name[len(prefix) :]
+    return None
+
+
+def get_tree_setting(settings, tree_name):
+    """Value of a per-tree setting for a tree, or None if it is not set"""
+    settings = dict(settings)
+    return settings.get(tree_name, settings.get("*"))
+
+
+def tune_tree(args, tree):
+    """Apply the requested auto-flush and basket size to an output tree"""
+    auto_flush = get_tree_setting(args.auto_flush, tree.GetName())
+    if auto_flush is not None:
+        tree.SetAutoFlush(auto_flush)
+    basket_size = get_tree_setting(args.basket_size, tree.GetName())
+    if basket_size is not None:
+        tree.SetBasketSize("*", basket_size)
+
+
+def output_settings(args, go_fast, input_compression):
+    """
+    Decide the compression of the output, None meaning ROOT's default, and
+    whether the baskets of the inputs can still be copied as they are
+    """
+    if args.compression is not None:
+        if go_fast and args.compression != input_compression:
+            go_fast = False
+            print("Disabling fast merging as the output compression is different")
+        compression = args.compression
+    else:
+        compression = input_compression if go_fast else None
+    if go_fast and (args.auto_flush or args.basket_size):
+        go_fast = False
+        print("Disabling fast merging to rewrite the baskets")
+    return go_fast, compression
+
+
+def compression_report(output_filename, write_time):
+    """Print the compression ratio of each output tree and the time to read it"""
+    output_file = ROOT.TFile.Open(output_filename)
+    print(
+        "Compression settings: {}, file size: {:.1f} MB, write time: {:.1f} s".format(
+            output_file.GetCompressionSettings(),
+            output_file.GetSize() / 1000.0**2,
+            write_time,
+        )
+    )
+    print(
+        "{:<20} {:>10} {:>12} {:>12} {:>7} {:>10} {:>10}".format(
+            "Tree", "Entries", "Size (MB)", "Zipped (MB)", "Ratio", "Read (s)", "MB/s"
+        )
+    )
+    for key in output_file.GetListOfKeys():
+        obj = key.ReadObj()
+        if not obj.IsA().InheritsFrom(ROOT.TTree.Class()):
+            continue
+        start = time.time()
+        ROOT.haddnano_read(obj)
+        read_time = time.time() - start
+        tot_bytes = obj.GetTotBytes() / 1000.0**2
+        zip_bytes = obj.GetZipBytes() / 1000.0**2
+        print(
+            "{:<20} {:>10} {:>12.1f} {:>12.1f} {:>7.2f} {:>10.2f} {:>10.1f}".format(
+                obj.GetName(),
+                obj.GetEntries(),
+                tot_bytes,
+                zip_bytes,
+                tot_bytes / zip_bytes if zip_bytes else 0,
+                read_time,
+                tot_bytes / read_time if read_time else 0,
+            )
+        )
+    output_file.Close()
+
+
+def in_memory(args, tree_name):
+    """Whether a tree is merged in memory rather than in the output file"""
+    return args.reduce_runs and tree_name == "Runs"
+
+
+def merge_option(args, tree_name, go_fast):
+    """
+    Option of CopyEntries and Merge for a tree. Trees merged in memory have no
+    file to copy the baskets to, so they are never fast merged.
+    """
+    return "fast" if go_fast and not in_memory(args, tree_name) else ""
+
+
+def merge_files(args, output_file, file_handles, go_fast, schemas, max_size=None):
+    """
+    Merge the trees of the input files into the output file. The file handles
+    are consumed one at a time, so they can come from a list of open files or
+    from stream_files(). The output trees are backfilled to the union schema
+    right after they are cloned from the first file, and every other input is
+    backfilled before it is merged, so no branch is ever added to the output
+    later on. If max_size (in bytes) is given, no more inputs are taken once the
+    output file reaches it and the remaining file handles are left for the next
+    output. Returns the number of input files merged.
+    """
+    trees = []
+    n_merged = 0
+
+    for fh in file_handles:
+        if not trees:
+            # Loop over all keys in first file
+            for key in fh.GetListOfKeys():
+                name = key.GetName()
+                print("Merging" + str(name))
+                obj = key.ReadObj()
+
+                # Make sure we are merging trees
+                is_tree = obj.IsA().InheritsFrom(ROOT.TTree.Class())
+                if not is_tree:
+                    print("Cannot handle " + str(obj.IsA().GetName()))
+                    continue
+
+                # Clone into the output file, not into the input file opened last.
+                # Runs is merged in memory when it is reduced, so that only the
+                # reduced tree is ever written to the output.
+                if in_memory(args, name):
+                    ROOT.gROOT.cd()
+                else:
+                    output_file.cd()
+                obj_out = obj.CloneTree(0)
+                tune_tree(args, obj_out)
+                obj_out.CopyEntries(obj, -1, merge_option(args, name, go_fast))
+                obj = obj_out
+                if name in schemas:
+                    backfill(obj, schemas[name])
+                trees.append(obj)
+        else:
+            inputs = ROOT.TList()
+            for obj in trees:
+                other_obj = fh.GetListOfKeys().FindObject(obj.GetName()).ReadObj()
+                inputs.Add(other_obj)
+                if obj.GetName() in schemas:
+                    other_obj.SetAutoFlush(0)
+                    backfill(other_obj, schemas[obj.GetName()])
+                # merge immediately
+                obj.Merge(inputs, merge_option(args, obj.GetName(), go_fast))
+                inputs.Clear()
+
+        n_merged += 1
+        # Stop before taking the next input, so that it opens the next output
+        if max_size and output_file.GetEND() >= max_size:
+            break
+
+    n_runs = None
+    for obj in trees:
+        if in_memory(args, obj.GetName()):
+            output_file.cd()
+            reduced = reduce_runs(obj)
+            obj.Delete()
+            obj = reduced
+            n_runs = obj.GetEntries()
+        # Trees filled entry by entry are auto saved along the way, so replace the
+        # last saved header instead of adding a cycle
+        obj.Write("", ROOT.TObject.kOverwrite)
+
+    if n_runs is not None and output_file.Get("Runs").GetEntries() != n_runs:
+        raise RuntimeError(
+            "{} does not hold the reduced Runs tree".format(output_file.GetName())
+        )
+
+    return n_merged
+
+
+def get_part_name(output_filename, part):
+    """Name of one of the outputs when rolling over, e.g. merged_3_part0.root"""
+    stem, extension = os.path.splitext(output_filename)
+    return "{}_part{}{}".format(stem, part, extension)
+
+
+def merge_to_file(args, output_filename, file_handles, go_fast, compression, schemas):
+    """
+    Create the output file and merge the given input files into it. With
+    --max-output-size, a new output <name>_part<K>.root is started every time the
+    current one reaches the target size. Returns the names of the outputs.
+    """
+    max_size = None
+    if getattr(args, "max_output_size", None):
+        max_size = args.max_output_size * 1000**3
+    file_handles = iter(file_handles)
+    outputs = []
+
+    while True:
+        if max_size:
+            filename = get_part_name(output_filename, len(outputs))
+        else:
+            filename = output_filename
+        output_file = ROOT.TFile(filename, "recreate")
+        if compression is not None:
+            output_file.SetCompressionSettings(compression)
+        output_file.cd()
+
+        n_merged = merge_files(
+            args, output_file, file_handles, go_fast, schemas, max_size
+        )
+
+        output_file.Close()
+        if n_merged == 0 and outputs:
+            # The previous output took the last input
+            os.remove(filename)
+            break
+        outputs.append(filename)
+        if not max_size or n_merged == 0:
+            break
+        print("Output {} is full, moving on to the next one".format(filename))
+
+    return outputs
+
+
+def merge_chunk(task):
+    """Merge one subset of the inputs, used by the worker processes"""
+    args, output_filename, input_files, go_fast, compression, schemas = task
+    merge_to_file(
+        args, output_filename, stream_files(input_files), go_fast, compression, schemas
+    )
+    return output_filename
+
+
+def split_chunks(items, n_chunks):
+    """Split a list in n_chunks contiguous parts of almost equal length"""
+    n_chunks = max(1, min(n_chunks, len(items)))
+    size, extra = divmod(len(items), n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        stop = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:stop])
+        start = stop
+    return chunks
+
+
+def parallel_merge(args, output_filename, input_files, go_fast, compression, schemas):
+    """
+    Merge disjoint, contiguous subsets of the inputs in a pool of processes and
+    reduce the partial outputs --fan-in at a time until one is left. The order of
+    the entries is the same as in a serial merge, and missing branches are
+    backfilled by the same code at every step. The partial outputs are all
+    written with the output compression, so unless the baskets are being
+    resized they are merged together with fast cloning.
+    """
+    tmp_dir = tempfile.mkdtemp(
+        prefix="haddnano_", dir=os.path.dirname(os.path.abspath(output_filename))
+    )
+    fan_in = max(2, args.fan_in)
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        chunks = split_chunks(input_files, args.jobs)
+        level = 0
+        while len(chunks) > 1:
+            print("Merging {} subsets in parallel".format(len(chunks)))
+            tasks = [
+                (
+                    args,
+                    os.path.join(tmp_dir, "partial_{}_{}.root".format(level, i)),
+                    chunk,
+                    go_fast,
+                    compression,
+                    schemas,
+                )
+                for i, chunk in enumerate(chunks)
+            ]
+            partials = pool.map(merge_chunk, tasks)
+            if level > 0:
+                for chunk in chunks:
+                    for partial in chunk:
+                        os.remove(partial)
+            chunks = [partials[i : i + fan_in] for i in range(0, len(partials), fan_in)]
+            go_fast = not (args.auto_flush or args.basket_size)
+            level += 1
+        merge_chunk((args, output_filename, chunks[0], go_fast, compression, schemas))
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+
+
 if "__main__" in __name__:
     # Input & output
     if len(sys.argv) < 3:
         print("Syntax: haddnano.py out.root input1.root input2.root ...")
         sys.exit(1)
 
-    output_filename = sys.argv[1]
-    input_files = sys.argv[2:]
+    args = get_args()
+
+    if args.max_output_size and args.jobs > 1:
+        print("--max-output-size cannot be used together with --jobs")
+        sys.exit(1)
 
-    # Open all input files
-    file_handles, go_fast = open_files(input_files)
+    if args.stream or args.jobs > 1:
+        # Only check the inputs here, they are opened again one by one while merging
+        input_files, go_fast, compression, schemas = scan_files(args.inputs)
+        file_handles = stream_files(input_files)
+    else:
+        # Open all input files
+        file_handles, go_fast = open_files(args.inputs)
+        input_files = file_handles
+        if file_handles:
+            compression = file_handles[0].GetCompressionSettings()
+        schemas = {}
+        for file_handle in file_handles:
+            update_schema(schemas, file_handle)
 
-    if not file_handles:
+    if not input_files:
         print("No valid input files found")
         sys.exit(1)
 
-    # Create output file
-    output_file = ROOT.TFile(output_filename, "recreate")
-    if go_fast:
-        output_file.SetCompressionSettings(file_handles[0].GetCompressionSettings())
-    output_file.cd()
-
-    # Loop over all keys in first file
-    for key in file_handles[0].GetListOfKeys():
-        name = key.GetName()
-        print("Merging" + str(name))
-        obj = key.ReadObj()
-        cl = ROOT.TClass.GetClass(key.GetClassName())
-        inputs = ROOT.TList()
+    if (
+        args.compression is not None
+        and args.compression // 100 == COMPRESSION_ALGORITHMS["ZSTD"]
+        and ROOT.gROOT.GetVersionInt() < 62000
+    ):
+        print("ZSTD compression needs ROOT 6.20 or newer")
+        sys.exit(1)
 
-        # Make sure we are merging trees
-        is_tree = obj.IsA().InheritsFrom(ROOT.TTree.Class())
-        if not is_tree:
-            print("Cannot handle " + str(obj.IsA().GetName()))
-            continue
+    go_fast, compression = output_settings(args, go_fast, compression)
 
-        obj = obj.CloneTree(-1, "fast" if go_fast else "")
-        branch_names = set([x.GetName() for x in obj.GetListOfBranches()])
-
-        # Loop over all input files
-        for fh in file_handles[1:]:
-            other_obj = fh.GetListOfKeys().FindObject(name).ReadObj()
-            inputs.Add(other_obj)
-            if obj.GetName() == "Events":
-                other_obj.SetAutoFlush(0)
-                other_branches = set(
-                    [x.GetName() for x in other_obj.GetListOfBranches()]
-                )
-                missing_branches = list(branch_names - other_branches)
-                additional_branches = list(other_branches - branch_names)
-                print(
-                    "missing: "
-                    + str(missing_branches)
-                    + "\n Additional:"
-                    + str(additional_branches)
-                )
-                for br in missing_branches:
-                    # fill "Other"
-                    zero_fill(other_obj, br, obj.GetListOfBranches().FindObject(br))
-                for br in additional_branches:
-                    # fill main
-                    branch_names.add(br)
-                    zero_fill(obj, br, other_obj.GetListOfBranches().FindObject(br))
-            if obj.GetName() == "Runs":
-                other_obj.SetAutoFlush(0)
-                other_branches = set(
-                    [x.GetName() for x in other_obj.GetListOfBranches()]
-                )
-                missing_branches = list(branch_names - other_branches)
-                additional_branches = list(other_branches - branch_names)
-                print(
-                    "missing: "
-                    + str(missing_branches)
-                    + "\n Additional:"
-                    + str(additional_branches)
-                )
-                for br in missing_branches:
-                    # fill "Other"
-                    zero_fill(
-                        other_obj,
-                        br,
-                        obj.GetListOfBranches().FindObject(br),
-                        allowNonBool=True,
-                    )
-                for br in additional_branches:
-                    # fill main
-                    branch_names.add(br)
-                    zero_fill(
-                        obj,
-                        br,
-                        other_obj.GetListOfBranches().FindObject(br),
-                        allowNonBool=True,
-                    )
-            # merge immediately
-            obj.Merge(inputs, "fast" if go_fast else "")
-            inputs.Clear()
-
-        obj.Write()
+    start = time.time()
+    if args.jobs > 1:
+        parallel_merge(args, args.output, input_files, go_fast, compression, schemas)
+        outputs = [args.output]
+    else:
+        outputs = merge_to_file(
+            args, args.output, file_handles, go_fast, compression, schemas
+        )
 
-    output_file.Close()
+    if args.report:
+        write_time = time.time() - start
+        for output in outputs:
+            compression_report(output, write_time)
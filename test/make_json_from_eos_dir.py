@@ -1,9 +1,8 @@
 from __future__ import print_function
 import argparse
 import json
-import subprocess
 import os
-from tqdm import tqdm
+import storage
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-d", "--dir", help="EOS directory path", required=True)
@@ -14,43 +13,51 @@ parser.add_argument(
     default="dataset_files.json",
     required=False,
 )
-
-xrootd_redirector = "root://cmseos.fnal.gov/"
-
-
-def get_files_recursive(path):
-    files = []
-    result = subprocess.check_output(
-        "eos {} ls {}".format(xrootd_redirector, path), shell=True
-    )
-    items = result.decode("utf-8").splitlines()
-
-    for item in items:
-        full_path = os.path.join(path, item)
-        if item.endswith(".root"):
-            files.append(os.path.join(xrootd_redirector + full_path))
-
-    return files
+parser.add_argument(
+    "--redirector",
+    default="root://cmseos.fnal.gov/",
+    help="Redirector URL of the storage: root://<host>/, eos://<host>/ or file://",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=16,
+    help="Number of directories listed in parallel",
+)
+storage.add_cache_arguments(parser)
+storage.add_listing_arguments(parser)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    backend = storage.get_backend(args.redirector)
 
     # Get all datasets in the top directory
     print("Listing datasets in {}".format(args.dir))
-    result = subprocess.check_output(
-        "eos {} ls {}".format(xrootd_redirector, args.dir), shell=True
-    )
-    datasets = result.decode("utf-8").splitlines()
+    datasets = storage.ls(backend, args.dir)
 
     print("Found {} datasets".format(len(datasets)))
 
-    file_dict = {}
+    # Find the files of all datasets in one crawl
+    cache = storage.open_cache(args)
+    try:
+        found = storage.find_root_files(
+            backend,
+            [os.path.join(args.dir, dataset) for dataset in datasets],
+            workers=args.workers,
+            cache=cache,
+            allow_missing=args.allow_missing,
+        )
+    finally:
+        if cache:
+            cache.close()
 
-    for dataset in tqdm(datasets):
-        if dataset:  # ignore empty lines
-            dataset_path = os.path.join(args.dir, dataset)
-            file_dict[dataset] = get_files_recursive(dataset_path)
+    file_dict = {}
+    for dataset in datasets:
+        file_dict[dataset] = [
+            backend.redirector + path
+            for path, _ in found[os.path.join(args.dir, dataset)]
+        ]
 
     # Write the dictionary to a JSON file
     with open(args.output, "w") as f:
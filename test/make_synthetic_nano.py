@@ -0,0 +1,294 @@
+"""
+Write synthetic files with the SUEPNano layout, to test and benchmark the merging
+and splitting scripts without real data. The files have an Events tree with the
+PFCands, lostTracks and isolatedTracks collections, one GenModel_<label> flag per
+model, a Runs tree with the per-model genEventCount/genEventSumw counters (also
+the PreSkim ones) and a LuminosityBlocks tree. The values are random.
+"""
+
+import argparse
+import os
+import ROOT  # type: ignore [import]
+
+# The event loop runs in C++, python would dominate the time to write the files
+ROOT.gInterpreter.Declare(
+    """
+#include <string>
+#include <vector>
+#include "TFile.h"
+#include "TRandom3.h"
+#include "TTree.h"
+
+struct SyntheticCollection {
+    std::string name;
+    double mean;
+    UInt_t max_n;
+    UInt_t n;
+    std::vector<std::string> float_vars;
+    std::vector<std::string> int_vars;
+    std::vector<std::vector<Float_t>> floats;
+    std::vector<std::vector<Int_t>> ints;
+
+    void book(TTree* tree) {
+        floats.assign(float_vars.size(), std::vector<Float_t>(max_n));
+        ints.assign(int_vars.size(), std::vector<Int_t>(max_n));
+        std::string counter = "n" + name;
+        tree->Branch(counter.c_str(), &n, (counter + "/i").c_str());
+        for (size_t k = 0; k < float_vars.size(); ++k) {
+            std::string branch = name + "_" + float_vars[k];
+            tree->Branch(branch.c_str(), floats[k].data(), (branch + "[" + counter + "]/F").c_str());
+        }
+        for (size_t k = 0; k < int_vars.size(); ++k) {
+            std::string branch = name + "_" + int_vars[k];
+            tree->Branch(branch.c_str(), ints[k].data(), (branch + "[" + counter + "]/I").c_str());
+        }
+    }
+
+    void generate(TRandom3& rng) {
+        n = std::min<UInt_t>(rng.Poisson(mean), max_n);
+        for (auto& var : floats)
+            for (UInt_t i = 0; i < n; ++i) var[i] = rng.Exp(2.);
+        for (auto& var : ints)
+            for (UInt_t i = 0; i < n; ++i) var[i] = (Int_t)rng.Integer(7) - 3;
+    }
+};
+
+void suepnano_make_file(const char* path,
+                        int compression,
+                        Long64_t n_events,
+                        const std::vector<std::string>& models,
+                        int n_extra,
+                        double mean_cands,
+                        int events_per_lumi,
+                        bool contiguous,
+                        double skim_efficiency,
+                        unsigned int seed) {
+    TFile* f = TFile::Open(path, "RECREATE");
+    f->SetCompressionSettings(compression);
+    TRandom3 rng(seed);
+    const size_t n_models = models.size();
+    const int n_lumis = std::max<Long64_t>(1, (n_events + events_per_lumi - 1) / events_per_lumi);
+
+    // Events
+    TTree* events = new TTree("Events", "Events");
+    UInt_t run = 1;
+    UInt_t lumi = 0;
+    ULong64_t event = 0;
+    Float_t gen_weight = 1;
+    events->Branch("run", &run, "run/i");
+    events->Branch("luminosityBlock", &lumi, "luminosityBlock/i");
+    events->Branch("event", &event, "event/l");
+    events->Branch("genWeight", &gen_weight, "genWeight/F");
+
+    std::vector<SyntheticCollection> collections(3);
+    collections[0].name = "PFCands";
+    collections[0].mean = mean_cands;
+    collections[0].float_vars = {"pt", "eta", "phi", "mass", "d0", "dz", "puppiWeight", "trkPt", "trkEta", "trkPhi"};
+    collections[0].int_vars = {"pdgId", "fromPV", "trkQuality"};
+    collections[1].name = "lostTracks";
+    collections[1].mean = mean_cands / 10.;
+    collections[1].float_vars = {"pt", "eta", "phi", "ptTrk", "d0", "dz"};
+    collections[1].int_vars = {"charge", "fromPV", "numberOfHits"};
+    collections[2].name = "isolatedTracks";
+    collections[2].mean = mean_cands / 50.;
+    collections[2].float_vars = {"pt", "eta", "phi", "d0", "dz", "pfRelIso03_all"};
+    collections[2].int_vars = {"charge", "pdgId", "fromPV"};
+    for (auto& collection : collections) {
+        collection.max_n = 3 * collection.mean + 10;
+        collection.book(events);
+    }
+
+    std::vector<Float_t> extra(n_extra);
+    for (int k = 0; k < n_extra; ++k) {
+        std::string branch = "Extra_" + std::to_string(k);
+        events->Branch(branch.c_str(), &extra[k], (branch + "/F").c_str());
+    }
+
+    std::vector<UChar_t> flags(n_models, 0);
+    for (size_t j = 0; j < n_models; ++j) {
+        std::string branch = "GenModel_" + models[j];
+        events->Branch(branch.c_str(), &flags[j], (branch + "/O").c_str());
+    }
+
+    // Events are grouped by lumi block and each lumi block has a single model,
+    // assigned either in order (contiguous entry ranges) or at random
+    std::vector<Long64_t> count(n_models, 0);
+    std::vector<double> sumw(n_models, 0), sumw2(n_models, 0);
+    int model = 0;
+    for (Long64_t i = 0; i < n_events; ++i) {
+        if (i % events_per_lumi == 0) {
+            ++lumi;
+            model = contiguous ? (int)((lumi - 1) * (Long64_t)n_models / n_lumis) : (int)rng.Integer(n_models);
+            std::fill(flags.begin(), flags.end(), 0);
+            if (n_models) flags[model] = 1;
+        }
+        event = i + 1 + (ULong64_t)seed * n_events;
+        gen_weight = rng.Gaus(1., 0.1);
+        for (auto& collection : collections) collection.generate(rng);
+        for (auto& value : extra) value = rng.Uniform();
+        if (n_models) {
+            count[model] += 1;
+            sumw[model] += gen_weight;
+            sumw2[model] += gen_weight * gen_weight;
+        }
+        events->Fill();
+    }
+
+    // LuminosityBlocks
+    TTree* lumis = new TTree("LuminosityBlocks", "LuminosityBlocks");
+    UInt_t lumi_block = 0;
+    lumis->Branch("run", &run, "run/i");
+    lumis->Branch("luminosityBlock", &lumi_block, "luminosityBlock/i");
+    for (lumi_block = 1; lumi_block <= (UInt_t)lumi; ++lumi_block) lumis->Fill();
+
+    // Runs, with the counters of NanoAOD and of GenWeightsTablePreSkimProducer
+    TTree* runs = new TTree("Runs", "Runs");
+    runs->Branch("run", &run, "run/i");
+    const size_t n_counters = n_models + 1;
+    std::vector<Long64_t> run_count(2 * n_counters);
+    std::vector<Double_t> run_sumw(2 * n_counters), run_sumw2(2 * n_counters);
+    for (size_t j = 0; j < n_counters; ++j) {
+        Long64_t c = 0;
+        double w = 0, w2 = 0;
+        for (size_t m = 0; m < n_models; ++m) {
+            if (j < n_models && m != j) continue;
+            c += count[m];
+            w += sumw[m];
+            w2 += sumw2[m];
+        }
+        std::string label = j < n_models ? "_" + models[j] : "";
+        for (int pre = 0; pre < 2; ++pre) {
+            size_t k = 2 * j + pre;
+            double scale = pre ? 1. / skim_efficiency : 1.;
+            std::string skim = pre ? "PreSkim" : "";
+            run_count[k] = c * scale;
+            run_sumw[k] = w * scale;
+            run_sumw2[k] = w2 * scale;
+            std::string name = "genEventCount" + skim + label;
+            runs->Branch(name.c_str(), &run_count[k], (name + "/L").c_str());
+            name = "genEventSumw" + skim + label;
+            runs->Branch(name.c_str(), &run_sumw[k], (name + "/D").c_str());
+            name = "genEventSumw2" + skim + label;
+            runs->Branch(name.c_str(), &run_sumw2[k], (name + "/D").c_str());
+        }
+    }
+    runs->Fill();
+
+    f->Write();
+    f->Close();
+    delete f;
+}
+"""
+)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Write synthetic files with the SUEPNano layout"
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, required=True, help="Output directory"
+    )
+    parser.add_argument("--files", type=int, default=1, help="Number of files to write")
+    parser.add_argument(
+        "--events", type=int, default=1000, help="Number of events per file"
+    )
+    parser.add_argument(
+        "--models", type=int, default=10, help="Number of signal models (scan points)"
+    )
+    parser.add_argument(
+        "--extra-branches",
+        type=int,
+        default=0,
+        help="Number of extra scalar Events branches, to emulate wider trees",
+    )
+    parser.add_argument(
+        "--pfcands",
+        type=float,
+        default=300,
+        help="Mean number of PF candidates per event. lostTracks and isolatedTracks "
+        "get 10 and 50 times less.",
+    )
+    parser.add_argument(
+        "--events-per-lumi",
+        type=int,
+        default=100,
+        help="Number of events per lumi block. All events of a lumi block belong to "
+        "the same model.",
+    )
+    parser.add_argument(
+        "--contiguous",
+        action="store_true",
+        help="Assign the models to the lumi blocks in order, so that the events of "
+        "each model form one contiguous range of entries, instead of at random",
+    )
+    parser.add_argument(
+        "--vary-models",
+        action="store_true",
+        help="Give each file a different subset of the models, so that the GenModel "
+        "and Runs branches differ between files and merging needs backfilling",
+    )
+    parser.add_argument(
+        "--skim-efficiency",
+        type=float,
+        default=0.1,
+        help="Fraction of events kept by the skim, used for the PreSkim counters",
+    )
+    parser.add_argument(
+        "--compression",
+        type=int,
+        default=209,
+        help="ROOT compression setting of the files (default: LZMA 9, as in NanoAOD)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args()
+
+
+def model_labels(n_models):
+    """Labels of the synthetic models, in the format of the signal scan labels"""
+    labels = []
+    for i in range(n_models):
+        labels.append(
+            "SUEP_mMed_{}_mDark_{}_temp_{}_decay_darkPhoHad".format(
+                125 + 100 * (i // 25), 1 + (i // 5) % 5, 1 + i % 5
+            )
+        )
+    return labels
+
+
+def make_files(args):
+    """Write the synthetic files, returning their paths"""
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    labels = model_labels(args.models)
+    paths = []
+    for i in range(args.files):
+        models = labels
+        if args.vary_models and len(labels) > 1:
+            # Drop a different model in every file
+            models = labels[: i % len(labels)] + labels[i % len(labels) + 1 :]
+        path = os.path.join(args.output, "synthetic_{}.root".format(i))
+        print("Writing {}".format(path))
+        model_names = ROOT.std.vector("std::string")()
+        for model in models:
+            model_names.push_back(model)
+        ROOT.suepnano_make_file(
+            path,
+            args.compression,
+            args.events,
+            model_names,
+            args.extra_branches,
+            args.pfcands,
+            args.events_per_lumi,
+            args.contiguous,
+            args.skim_efficiency,
+            args.seed + i,
+        )
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    args = get_args()
+    make_files(args)
@@ -2,51 +2,31 @@
 Run this script to merge files from different directories on EOS.
 """
 
-import subprocess
 import argparse
 import os
+import re
 import time
 import sys
 import json
+import collections
+import condor_utils
+import storage
 
 
 def eos_ls(args, directory):
-    """List contents of a directory on EOS"""
-    max_retries = 3
-    retry_delay = 1  # seconds
-
-    for attempt in range(max_retries):
-        try:
-            command = "source ~/.bash_profile 2>/dev/null; eos {} ls {}".format(
-                args.redirector, directory
-            )
-            result = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                executable="/bin/bash",
-            )
-            out, err = result.communicate()
-            # If error occurred or output is empty, try again
-            if err or not out:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                return []
-            return [x for x in out.decode("utf-8").strip().split("\n") if x]
-        except:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                continue
-            return []
-    return []
+    """List contents of a directory on EOS, nothing if it cannot be listed"""
+    try:
+        return storage.ls(args.backend, directory)
+    except storage.StorageError as e:
+        if args.verbose:
+            print("  {}".format(e))
+        return []
 
 
 def get_datasets_and_files(args):
     """
     Get all datasets and their ROOT files in a single pass.
-    Returns a dictionary {dataset_dir: [root_files]}
+    Returns a dictionary {dataset_dir: {root_file: size in bytes}}
     """
     # Get datasets to process if a JSON file is provided
     if args.dataset:
@@ -55,74 +35,76 @@ def get_datasets_and_files(args):
             datasets = json.load(f)
 
     print("Scanning input directory: {}".format(args.input))
-    dataset_files = {}
     top_contents = eos_ls(args, args.input)
     if args.dataset:
         top_contents = [x for x in top_contents for y in datasets if x in y]
     print("Found {} potential dataset directories".format(len(top_contents)))
 
-    # Process each potential dataset directory
-    for i, dataset in enumerate(top_contents, 1):
-        print("\nProcessing directory {}/{}".format(i, len(top_contents)))
-        dataset_path = os.path.join(args.input, dataset)
-        files = get_root_files_recursive(args, dataset_path)
+    # Scan all dataset directories together
+    dataset_paths = [os.path.join(args.input, dataset) for dataset in top_contents]
+    cache = storage.open_cache(args)
+    try:
+        found = storage.find_root_files(
+            args.backend,
+            dataset_paths,
+            workers=args.workers,
+            verbose=args.verbose,
+            cache=cache,
+            allow_missing=args.allow_missing,
+        )
+    except storage.StorageError as e:
+        # Planning the jobs without them would silently leave their files out
+        print("{}. Use --allow_missing to go on without them.".format(e))
+        sys.exit(1)
+    finally:
+        if cache:
+            cache.close()
+
+    dataset_files = {}
+    for dataset_path in dataset_paths:
+        files = found[dataset_path]
         if files:  # Only include directories that have ROOT files
-            dataset_files[dataset_path] = files
-            print("  -> Found {} ROOT files".format(len(files)))
+            dataset_files[dataset_path] = collections.OrderedDict(files)
+            print("  {} -> Found {} ROOT files".format(dataset_path, len(files)))
         else:
-            print("  -> No ROOT files found")
+            print("  {} -> No ROOT files found".format(dataset_path))
 
     return dataset_files
 
 
-def get_root_files_recursive(args, directory):
-    """Recursively get all .root files from a directory"""
-    if args.verbose:
-        print("  Scanning {}".format(directory))
+def eos_cat(args, file_path):
+    """Read a (small) file from EOS"""
+    return args.backend.read(file_path)
 
-    # Skip if this is a log directory
-    if "/log" in directory:
-        return []
-
-    result = []
-    contents = eos_ls(args, directory)
 
-    for item in contents:
-        if not item:  # Skip empty strings
-            continue
-
-        full_path = os.path.join(directory, item)
-
-        # Skip log directories
-        if item == "log":
+def read_manifests(args, output_dir, items):
+    """
+    Read the manifests of the merged files already in the output directory,
+    given the names of the files it holds. Returns a dictionary
+    {output index: manifest}.
+    """
+    manifests = {}
+    for item in items:
+        match = re.match(r"^merged_(\d+)\.json$", item)
+        if not match:
             continue
-
-        if item.endswith(".root"):
-            result.append(full_path)
-            if args.verbose:
-                print("    Found ROOT file: {}".format(item))
-        else:
-            # Try to list the item - if it succeeds and returns content, it's a directory
-            subdir_contents = eos_ls(args, full_path)
-            if subdir_contents:  # Only recurse if we got valid contents
-                result.extend(get_root_files_recursive(args, full_path))
-
-    return result
+        try:
+            manifests[int(match.group(1))] = json.loads(
+                eos_cat(args, os.path.join(output_dir, item))
+            )
+        except (ValueError, storage.StorageError):
+            print("  Cannot read manifest {}, ignoring it".format(item))
+    return manifests
 
 
-def eos_file_size(args, file_path):
-    """Get the size of a file on EOS in bytes"""
-    command = "eos {} stat {}".format(args.redirector, file_path)
-    result = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, executable="/bin/bash"
-    )
-    out, err = result.communicate()
-    next_one = False
-    for item in out.decode("utf-8").strip().split(" "):
-        if next_one:
-            return int(item)
-        if item == "Size:":
-            next_one = True
+def get_used_indices(items):
+    """Output indices of the merged files and manifests among the given names"""
+    indices = set()
+    for item in items:
+        match = re.match(r"^merged_(\d+)(_part\d+)?\.(root|json)$", item)
+        if match:
+            indices.add(int(match.group(1)))
+    return indices
 
 
 def get_args():
@@ -150,11 +132,24 @@ def get_args():
     parser.add_argument(
         "--max_size", type=int, default=2, help="Maximum size of output files in GB"
     )
+    condor_utils.add_packing_arguments(parser)
+    condor_utils.add_sandbox_arguments(parser)
+    parser.add_argument(
+        "--output_size",
+        type=float,
+        default=None,
+        help="Target size of the merged files in GB. haddnano.py then rolls over to "
+        "merged_<N>_part<K>.root whenever the output reaches it, so that all merged "
+        "files have about the same size whatever the compression of the inputs. "
+        "haddnano.py then runs on a single core.",
+    )
     parser.add_argument(
         "--redirector",
         type=str,
         default="root://cmseos.fnal.gov/",
-        help="EOS redirector for the input files",
+        help="Redirector URL of the storage: root://<host>/ (XRootD python bindings, "
+        "or the eos command if they are missing), eos://<host>/ (eos command) or "
+        "file:// (local directories)",
     )
     parser.add_argument(
         "--memory",
@@ -162,15 +157,85 @@ def get_args():
         default=5000,
         help="Memory request for condor jobs in MB",
     )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=1,
+        help="Number of cores to request for condor jobs. haddnano.py uses all of them.",
+    )
+    parser.add_argument(
+        "--reduce_runs",
+        action="store_true",
+        help="Sum the Runs tree counters per run in the merged files",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default=None,
+        help="Compression of the merged files, e.g. ZSTD:5 or LZ4:4. See haddnano.py --help.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of directories listed in parallel when scanning the input",
+    )
+    storage.add_cache_arguments(parser)
+    storage.add_listing_arguments(parser)
     parser.add_argument(
         "--verbose",
         action="store_true",
         help="Print detailed progress information",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only merge input files that are not yet in the manifests of the merged "
+        "files in the output directory. New files are first appended to merged files "
+        "below --max_size and then merged into new files. Full merged files are not touched.",
+    )
+    args = parser.parse_args()
+    args.backend = storage.get_backend(args.redirector)
+    return args
+
+
+def get_haddnano_options(args):
+    """Options passed on to haddnano.py in the merge jobs"""
+    options = ""
+    if args.reduce_runs:
+        options += "--reduce-runs "
+    if args.compression:
+        options += "--compression {} ".format(args.compression)
+    if args.output_size:
+        options += "--max-output-size {} ".format(args.output_size)
+    return options
+
+
+def get_verify_options(args):
+    """Options passed on to verify_merge.py in the merge jobs"""
+    options = ""
+    if args.reduce_runs:
+        options += "--reduce-runs "
+    if args.output_size:
+        options += "--parts "
+    return options
 
 
-def create_condor_script(args, dataset_dir, files, max_size, work_dir, cmssw_version):
+def get_output_name(args, index):
+    """Name of the merged file(s) of a job, a glob pattern when they come in parts"""
+    if args.output_size:
+        return "merged_{}_part*.root".format(index)
+    return "merged_{}.root".format(index)
+
+
+def get_remove_command(args):
+    """Shell command the jobs remove a file of the output directory with"""
+    if args.backend.redirector:
+        return "xrdfs {} rm".format(args.backend.redirector.rstrip("/"))
+    return "rm -f"
+
+
+def create_condor_script(args, dataset_dir, file_sizes, max_size, work_dir, sandbox):
     """Create a condor submission script and executable for this dataset"""
     dataset_name = os.path.basename(dataset_dir)
 
@@ -179,7 +244,12 @@ def create_condor_script(args, dataset_dir, files, max_size, work_dir, cmssw_ver
         os.makedirs(work_dir_dataset)
 
     # Write the split file lists
-    n_jobs = split_files_for_jobs(files, max_size, args, work_dir_dataset)
+    output_dir = os.path.join(args.output, dataset_name)
+    jobs = plan_jobs(args, file_sizes, max_size, output_dir)
+    if not jobs:
+        print("  -> Nothing new to merge")
+        return None
+    write_jobs(args, jobs, work_dir_dataset)
 
     # Write merge script
     merge_script = os.path.join(work_dir_dataset, "merge.sh")
@@ -197,33 +267,38 @@ echo "Running merge for job $1"
 echo "Contents of working directory:"
 ls -la
 
-# Move to a tmp dir to avoid conflicts
-tmp_dir=$(mktemp -d -p .)
-cd $tmp_dir
-tar -xf ../{cmssw_version}.tar.gz
-rm ../{cmssw_version}.tar.gz
-export SCRAM_ARCH=slc7_amd64_gcc700
-if [ ! -d {cmssw_version}/src ]; then
-    mkdir -p {cmssw_version}/src
-fi
-mv ../files_$1.txt ../haddnano.py {cmssw_version}/src
-cd {cmssw_version}/src
-eval $(scramv1 runtime -sh) # cmsenv is an alias not on the workers
+{setup}
+
+# The manifest is copied as incomplete before the output, and as complete only
+# once the output is in place, so that an interrupted job is never taken for
+# unmerged inputs by merge.py --incremental
+sed 's/"complete": true/"complete": false/' manifest_$1.json > pending_$1.json
 
 # If there is only one file, just copy it
 if [ $(wc -l < files_$1.txt) -eq 1 ]; then
-    xrdcp -f $(cat files_$1.txt) {redirector}{output_dir}/merged_$1.root
+    xrdcp -f pending_$1.json {redirector}{output_dir}/merged_$1.json
+    if [ $? -ne 0 ]; then
+        echo "Copy of the manifest to EOS failed!"
+        exit 1
+    fi
+    xrdcp --posc -f $(cat files_$1.txt) {redirector}{output_dir}/{single_output}
     if [ $? -ne 0 ]; then
         echo "Copy to EOS failed!"
         exit 1
     fi
+    # Record that the merged file is complete
+    xrdcp -f manifest_$1.json {redirector}{output_dir}/merged_$1.json
+    if [ $? -ne 0 ]; then
+        echo "Copy of the manifest to EOS failed!"
+        exit 1
+    fi
     echo "Cleaning up"
     echo "Job completed successfully"
     exit 0
 fi
 
 # Do the merge
-python haddnano.py merged_$1.root $(cat files_$1.txt)
+python haddnano.py --stream --jobs {jobs} {haddnano_options}merged_$1.root $(cat files_$1.txt)
 
 # Check if merge was successful
 if [ $? -ne 0 ]; then
@@ -231,27 +306,64 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
+# Check the merged file against the inputs before copying it
+python verify_merge.py {verify_options}merged_$1.root $(cat files_$1.txt)
+if [ $? -ne 0 ]; then
+    echo "Verification of the merged file failed!"
+    exit 1
+fi
+
 # Copy output
-xrdcp -f merged_$1.root {redirector}{output_dir}/merged_$1.root
+xrdcp -f pending_$1.json {redirector}{output_dir}/merged_$1.json
 if [ $? -ne 0 ]; then
-    echo "Copy to EOS failed!"
+    echo "Copy of the manifest to EOS failed!"
     exit 1
 fi
+for merged in {outputs}; do
+    xrdcp --posc -f $merged {redirector}{output_dir}/$merged
+    if [ $? -ne 0 ]; then
+        echo "Copy to EOS failed!"
+        exit 1
+    fi
+done
+
+# Record that the merged file is complete, only once it is in place
+xrdcp -f manifest_$1.json {redirector}{output_dir}/merged_$1.json
+if [ $? -ne 0 ]; then
+    echo "Copy of the manifest to EOS failed!"
+    exit 1
+fi
+
+# An append job writes a new merged file and removes the one it appended to only
+# now, so that a failed job leaves it in place
+replaced=$(sed -n 's/.*"replaces": \([0-9]*\).*/\1/p' manifest_$1.json)
+if [ -n "$replaced" ]; then
+    {remove} {output_dir}/merged_$replaced.root && {remove} {output_dir}/merged_$replaced.json
+    if [ $? -ne 0 ]; then
+        echo "Removal of merged_$replaced failed, merge.py --incremental will report it"
+    fi
+fi
 
 echo "Cleaning up"
-rm merged_$1.root
+rm {outputs}
 echo "Job completed successfully"
 """.format(
-                redirector=args.redirector,
-                output_dir=os.path.join(args.output, dataset_name),
-                cmssw_version=cmssw_version,
+                redirector=args.backend.redirector,
+                remove=get_remove_command(args),
+                output_dir=output_dir,
+                setup=sandbox.setup_commands(["files_$1.txt", "manifest_$1.json"]),
+                # haddnano.py can only roll over outputs on a single core
+                jobs=1 if args.output_size else args.cpus,
+                haddnano_options=get_haddnano_options(args),
+                verify_options=get_verify_options(args),
+                outputs=get_output_name(args, "$1"),
+                single_output=(
+                    "merged_$1_part0.root" if args.output_size else "merged_$1.root"
+                ),
             )
         )
     os.chmod(merge_script, 0o755)
 
-    # Get CMSSW tarball name
-    cmssw_tarball = "{}.tar.gz".format(cmssw_version)
-
     # Create the condor submit file
     submit_file = os.path.join(work_dir_dataset, "submit.jdl")
     with open(submit_file, "w") as f:
@@ -259,19 +371,20 @@ echo "Job completed successfully"
             """# Condor submit file for merging files
 universe = vanilla
 executable = {executable}
-arguments = $(ProcId)
+arguments = $(Job)
 output = {work_dir_dataset}/$(ClusterId).$(ProcId).stdout
 error = {work_dir_dataset}/$(ClusterId).$(ProcId).stderr
 log = {work_dir_dataset}/$(ClusterId).$(ProcId).log
 
 # Transfer files
-transfer_input_files = {work_dir_dataset}/files_$(ProcId).txt,haddnano.py,{cmssw_tarball}
+transfer_input_files = {work_dir_dataset}/files_$(Job).txt,{work_dir_dataset}/manifest_$(Job).json,{sandbox_files}
 should_transfer_files = YES
 when_to_transfer_output = ON_EXIT
 
 # Requirements and resources
 x509userproxy = $ENV(X509_USER_PROXY)
 request_memory = {memory}
+request_cpus = {cpus}
 +REQUIRED_OS = "rhel7"
 +DesiredOS = REQUIRED_OS
 
@@ -298,101 +411,167 @@ periodic_hold_reason = strcat("Job held by PERIODIC_HOLD due to ", \\
     ifThenElse(( DiskUsage > 38000000 ), "disk usage greater than 38GB", \\
                 strcat("memory usage ",ResidentSetSize," greater than requested ",RequestMemory*1000))))), ".")
 
-queue {n_jobs}
+queue Job from {work_dir_dataset}/jobs.txt
 """.format(
                 executable=merge_script,
                 work_dir_dataset=work_dir_dataset,
-                n_jobs=n_jobs,
-                cmssw_tarball=cmssw_tarball,
+                sandbox_files=",".join(sandbox.files),
                 memory=args.memory,
+                cpus=args.cpus,
             )
         )
 
     return submit_file
 
 
-def split_files_for_jobs(files, max_size, args, work_dir_job):
-    """Split files into groups based on size"""
-    groups = []
-    current_group = []
-    current_size = 0
-
-    for f in files:
-        size = eos_file_size(args, f)
-        if current_size + size > max_size and current_group:
-            groups.append(current_group)
-            current_group = []
-            current_size = 0
-        current_group.append(f)
-        current_size += size
-
-    if current_group:
-        groups.append(current_group)
+def plan_jobs(args, file_sizes, max_size, output_dir):
+    """
+    Decide which files each merge job gets. Returns a dictionary
+    {output index: (input files, manifest)}, where the manifest lists all the
+    files that end up in merged_<index>.root. In incremental mode, files already
+    in a manifest are skipped, the new ones are appended to the merged files that
+    are below max_size and the rest go to new merged files. Appending writes a
+    new merged file, whose manifest gives the index of the merged file it
+    replaces, removed by the job once the new one is complete.
+    """
+    jobs = {}
+    next_index = 0
+    files = list(file_sizes)
+    sizes = file_sizes
+
+    if args.incremental:
+        items = eos_ls(args, output_dir)
+        manifests = read_manifests(args, output_dir, items)
+        done = set(
+            path for manifest in manifests.values() for path in manifest["inputs"]
+        )
+        files = [f for f in files if f not in done]
+        print(
+            "  -> {} merged files with {} inputs already, {} new inputs".format(
+                len(manifests), len(done), len(files)
+            )
+        )
 
-    # Write each group to a separate file
-    for i, group in enumerate(groups):
-        output_file = os.path.join(work_dir_job, "files_{}.txt".format(i))
-        with open(output_file, "w") as f:
-            for file_path in group:
-                f.write(args.redirector + file_path + "\n")
+        # A job marks its manifest as incomplete before copying its output, so
+        # the inputs of an interrupted job are not merged a second time
+        pending = [
+            i for i in sorted(manifests) if not manifests[i].get("complete", True)
+        ]
+        for index in pending:
+            print(
+                "  Warning: the job of merged_{0} did not complete. Check the merged "
+                "file with verify_merge.py against the inputs in merged_{0}.json "
+                "and resubmit the job if needed.".format(index)
+            )
 
-    return len(groups)
+        # Merged files that another one replaces are only left if their removal
+        # failed, or if the job that replaces them is not done yet
+        replaced = dict(
+            (manifest["replaces"], i)
+            for i, manifest in manifests.items()
+            if "replaces" in manifest
+        )
+        for index in sorted(set(replaced) & set(manifests)):
+            if replaced[index] not in pending:
+                print(
+                    "  Warning: merged_{0} was appended to merged_{1}, remove "
+                    "merged_{0}.root and merged_{0}.json".format(index, replaced[index])
+                )
+
+        # New merged files never reuse the index of a file in the output
+        # directory, even one without a manifest
+        used = get_used_indices(items)
+        if used:
+            next_index = max(used) + 1
+
+        # Append to the merged files that are not full yet, writing a new merged
+        # file so that the old one stays in place until the new one is complete.
+        # Merged files in parts are left alone, since the last part cannot be told
+        # from the manifest.
+        for index in sorted(manifests if not args.output_size else []):
+            if index in pending or index in replaced:
+                continue
+            manifest = manifests[index]
+            appended = []
+            size = manifest["size"]
+            while files and size + sizes[files[0]] <= max_size:
+                appended.append(files.pop(0))
+                size += sizes[appended[-1]]
+            if appended:
+                merged = os.path.join(output_dir, "merged_{}.root".format(index))
+                jobs[next_index] = (
+                    [merged] + appended,
+                    {
+                        "inputs": manifest["inputs"] + appended,
+                        "size": size,
+                        "replaces": index,
+                    },
+                )
+                next_index += 1
+
+    groups = condor_utils.group_files(
+        files, sizes, max_size, args.packing, args.min_fill
+    )
+    for index, group in enumerate(groups, next_index):
+        jobs[index] = (
+            group,
+            {"inputs": group, "size": sum(sizes[f] for f in group)},
+        )
 
+    return jobs
 
-def create_cmssw_tarball():
-    """Create a tarball of the current CMSSW environment"""
-    if not "CMSSW_BASE" in os.environ:
-        print("Please run cmsenv in your CMSSW environment first")
-        sys.exit(1)
 
-    cmssw_base = os.environ["CMSSW_BASE"]
-    cmssw_version = os.path.basename(cmssw_base)
-    tarball = "{}.tar.gz".format(cmssw_version)
-
-    # Check if tarball already exists
-    if os.path.exists(tarball):
-        os.remove(tarball)
-
-    print("Creating CMSSW tarball...")
-    # Get the relative path from where we are to CMSSW_BASE
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(cmssw_base))
-
-    # Create the tarball excluding unnecessary directories
-    cmd = (
-        "tar --exclude-caches-all --exclude-vcs -zcf {cwd}/{version}.tar.gz -C {version}/.. "
-        "{version} --exclude=src --exclude=tmp --exclude=*.tar.gz --exclude=*.root"
-    ).format(cwd=cwd, tarball=tarball, version=cmssw_version)
-    subprocess.check_call(cmd.split())
-    os.chdir(cwd)
-    print(
-        "Created CMSSW tarball: {} of size {} MB".format(
-            tarball, round(os.path.getsize(tarball) / 1000.0**2, 1)
-        )
-    )
-    return tarball, cmssw_version
+def write_jobs(args, jobs, work_dir_job):
+    """Write the file list and the manifest of each job and the list of jobs"""
+    for index, (group, manifest) in sorted(jobs.items()):
+        output_file = os.path.join(work_dir_job, "files_{}.txt".format(index))
+        with open(output_file, "w") as f:
+            for file_path in group:
+                f.write(args.backend.redirector + file_path + "\n")
+        manifest_file = os.path.join(work_dir_job, "manifest_{}.json".format(index))
+        contents = {
+            "output": get_output_name(args, index),
+            "inputs": manifest["inputs"],
+            "size": manifest["size"],
+            "complete": True,
+        }
+        if "replaces" in manifest:
+            contents["replaces"] = manifest["replaces"]
+        with open(manifest_file, "w") as f:
+            json.dump(contents, f, indent=4)
+
+    with open(os.path.join(work_dir_job, "jobs.txt"), "w") as f:
+        for index in sorted(jobs):
+            f.write("{}\n".format(index))
 
 
 if __name__ == "__main__":
     args = get_args()
 
-    # Check for haddnano.py
-    if not os.path.exists("haddnano.py"):
-        print("Please make sure haddnano.py is in the current directory")
-        sys.exit(1)
+    # Check for the scripts the jobs run
+    for script in ["haddnano.py", "nano_trees.py", "verify_merge.py"]:
+        if not os.path.exists(script):
+            print("Please make sure {} is in the current directory".format(script))
+            sys.exit(1)
 
-    # Create CMSSW tarball
-    cmssw_tarball, cmssw_version = create_cmssw_tarball()
+    # Create a working directory for condor files
+    work_dir = "condor_merge_{}".format(time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(work_dir)
+
+    # Scripts and environment of the jobs, before the slow scan of the input.
+    # The tarball of --sandbox cmssw leaves out src as before.
+    sandbox = condor_utils.create_sandbox(
+        args,
+        work_dir,
+        ["haddnano.py", "nano_trees.py", "verify_merge.py"],
+        excludes=["src"],
+    )
 
     # Get all datasets and their files in one pass
     dataset_files = get_datasets_and_files(args)
 
     print("Found {} datasets to process:".format(len(dataset_files)))
 
-    # Create a working directory for condor files
-    work_dir = "condor_merge_{}".format(time.strftime("%Y%m%d-%H%M%S"))
-    os.makedirs(work_dir)
-
     submit_files = []
     for dataset_dir in sorted(dataset_files.keys()):
         print("  {} ({} files)".format(dataset_dir, len(dataset_files[dataset_dir])))
@@ -404,9 +583,10 @@ if __name__ == "__main__":
             dataset_files[dataset_dir],
             args.max_size * 1000**3,
             work_dir,
-            cmssw_version,
+            sandbox,
         )
-        submit_files.append(submit_file)
+        if submit_file:
+            submit_files.append(submit_file)
 
     # Create a master submit script
     submit_script = os.path.join(work_dir, "submit_all.sh")
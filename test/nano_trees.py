@@ -0,0 +1,85 @@
+"""
+Helpers to read and write NanoAOD trees with PyROOT, shared by haddnano.py and
+split_trees.py. The condor jobs get this file together with those scripts.
+"""
+
+import collections
+import numpy
+import ROOT  # type: ignore [import]
+
+# typename: (numpy type code, root type code)
+BRANCH_TYPES = {
+    "Bool_t": ("?", "O"),
+    "Char_t": ("i1", "B"),
+    "UChar_t": ("u1", "b"),
+    "Short_t": ("i2", "S"),
+    "UShort_t": ("u2", "s"),
+    "Int_t": ("i4", "I"),
+    "UInt_t": ("u4", "i"),
+    "Float_t": ("f4", "F"),
+    "Double_t": ("f8", "D"),
+    "Long64_t": ("i8", "L"),
+    "ULong64_t": ("u8", "l"),
+}
+
+
+def read_runs(tree_in):
+    """
+    Read all entries of a Runs tree once. Runs trees are small, so this is done
+    leaf by leaf. Returns a dictionary {branch name: (type name, counter branch
+    name, static length, values of each entry)}, in the order of the branches.
+    """
+    leaves = [
+        (br.GetName(), br.GetLeaf(br.GetName())) for br in tree_in.GetListOfBranches()
+    ]
+    runs = collections.OrderedDict()
+    for name, leaf in leaves:
+        count = leaf.GetLeafCount()
+        runs[name] = (
+            leaf.GetTypeName(),
+            count.GetName() if count else None,
+            leaf.GetLenStatic(),
+            [],
+        )
+    for i in range(tree_in.GetEntries()):
+        tree_in.GetEntry(i)
+        for name, leaf in leaves:
+            runs[name][3].append([leaf.GetValue(j) for j in range(leaf.GetLen())])
+    return runs
+
+
+def write_runs_tree(runs, plan):
+    """
+    Create a Runs tree in the current directory from values as read by
+    read_runs. plan lists the branches to write as (input name, output name,
+    output title).
+    """
+    tree_out = ROOT.TTree("Runs", "Runs")
+    new_names = dict((name, new_name) for name, new_name, _ in plan)
+    buffers = []
+    for name, new_name, title in plan:
+        type_name, count, length, values = runs[name]
+        if type_name not in BRANCH_TYPES:
+            print(
+                "Cannot copy Runs branch %s of type %s, skipping it" % (name, type_name)
+            )
+            continue
+        numpy_type, root_type = BRANCH_TYPES[type_name]
+        if count:
+            leaflist = "{}[{}]/{}".format(
+                new_name, new_names.get(count, count), root_type
+            )
+        elif length > 1:
+            leaflist = "{}[{}]/{}".format(new_name, length, root_type)
+        else:
+            leaflist = "{}/{}".format(new_name, root_type)
+        size = max([1, length] + [len(entry) for entry in values])
+        buff = numpy.zeros(size, dtype=numpy.dtype(numpy_type))
+        branch = tree_out.Branch(new_name, buff, leaflist)
+        branch.SetTitle(title)
+        buffers.append((buff, values))
+    for i in range(len(buffers[0][1]) if buffers else 0):
+        for buff, values in buffers:
+            buff[: len(values[i])] = values[i]
+        tree_out.Fill()
+    return tree_out
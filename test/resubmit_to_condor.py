@@ -2,12 +2,12 @@
 Resubmit failed CRAB jobs to condor.
 """
 
-import subprocess
 import importlib
 import argparse
 import os
 import sys
 import time
+import condor_utils
 
 
 def get_args():
@@ -43,6 +43,7 @@ def get_args():
         action="store_true",
         help="Submit one job per input file",
     )
+    condor_utils.add_tarball_arguments(parser)
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -63,6 +64,11 @@ def create_condor_script(args, job, work_dir, files, cmssw_version):
         for file in files:
             f.write("{}\n".format(file))
 
+    # Get CMSSW tarball name
+    cmssw_tarball = condor_utils.get_tarball_name(
+        cmssw_version, args.tarball_compression
+    )
+
     # Write condor executino script
     exec_script = os.path.join(work_dir_job, "run_cmssw.sh")
     with open(exec_script, "w") as f:
@@ -83,8 +89,8 @@ ls -la
 # Move to a tmp dir to avoid conflicts
 tmp_dir=$(mktemp -d -p .)
 cd $tmp_dir
-tar -xf ../{cmssw_version}.tar.gz
-rm ../{cmssw_version}.tar.gz
+tar -xf ../{cmssw_tarball}
+rm ../{cmssw_tarball}
 export SCRAM_ARCH=slc7_amd64_gcc700
 if [ ! -d {cmssw_version}/src ]; then
     mkdir -p {cmssw_version}/src
@@ -119,13 +125,11 @@ echo "Job completed successfully"
 """.format(
                 job=job,
                 cmssw_version=cmssw_version,
+                cmssw_tarball=cmssw_tarball,
             )
         )
     os.chmod(exec_script, 0o755)
 
-    # Get CMSSW tarball name
-    cmssw_tarball = "{}.tar.gz".format(cmssw_version)
-
     # Create the condor submit file
     submit_file = os.path.join(work_dir_job, "submit.jdl")
     with open(submit_file, "w") as f:
@@ -188,40 +192,6 @@ queue 1
     return submit_file
 
 
-def create_cmssw_tarball():
-    """Create a tarball of the current CMSSW environment"""
-    if not "CMSSW_BASE" in os.environ:
-        print("Please run cmsenv in your CMSSW environment first")
-        sys.exit(1)
-
-    cmssw_base = os.environ["CMSSW_BASE"]
-    cmssw_version = os.path.basename(cmssw_base)
-    tarball = "{}.tar.gz".format(cmssw_version)
-
-    # Check if tarball already exists
-    if os.path.exists(tarball):
-        os.remove(tarball)
-
-    print("Creating CMSSW tarball...")
-    # Get the relative path from where we are to CMSSW_BASE
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(cmssw_base))
-
-    # Create the tarball excluding unnecessary directories
-    cmd = (
-        "tar --exclude-caches-all --exclude-vcs -zcf {cwd}/{version}.tar.gz -C {version}/.. "
-        "{version} --exclude=tmp --exclude=*.tar.gz --exclude=*.root"
-    ).format(cwd=cwd, tarball=tarball, version=cmssw_version)
-    subprocess.check_call(cmd.split())
-    os.chdir(cwd)
-    print(
-        "Created CMSSW tarball: {} of size {} MB".format(
-            tarball, round(os.path.getsize(tarball) / 1000.0**2, 1)
-        )
-    )
-    return tarball, cmssw_version
-
-
 def split_input_files(input):
     """Split input files into individual jobs"""
     output = {}
@@ -239,7 +209,9 @@ if __name__ == "__main__":
     input = importlib.import_module(args.input.replace(".py", ""))
 
     # Create CMSSW tarball
-    cmssw_tarball, cmssw_version = create_cmssw_tarball()
+    cmssw_tarball, cmssw_version = condor_utils.create_cmssw_tarball(
+        args.tarball_compression, args.rebuild_tarball
+    )
 
     input_files = input.files_for_condor
     if args.max_split:
@@ -1,9 +1,189 @@
 import argparse
 import glob
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
 import subprocess
+import sys
+import numpy
 from tqdm import tqdm  # type: ignore [import]
 import ROOT  # type: ignore [import]
+from nano_trees import read_runs, write_runs_tree
+
+# Number of events whose GenModel flags are read at once
+SCAN_CHUNK_SIZE = 100000
+
+# Bytes of baskets kept in memory by all the output Events trees together before
+# they are flushed to their files
+FAN_OUT_MEMORY = 1000**3
+
+# Smallest basket of the output Events trees that are not fast cloned
+FAN_OUT_MIN_BASKET_SIZE = 1000
+
+# Size of the read cache of the input Events tree when splitting it
+FAN_OUT_CACHE_SIZE = 100 * 1000**2
+
+# Reading the GenModel flags (or the genModelIndex column) entry by entry and
+# model by model from python takes minutes per file, so they are read column by
+# column in C++ instead.
+ROOT.gInterpreter.Declare(
+    """
+void split_trees_read_flags(TTree* tree,
+                            const std::vector<std::string>& branch_names,
+                            Long64_t first,
+                            Long64_t n_entries,
+                            UChar_t* flags) {
+    // Fill flags[i * n_branches + j] with branch j of entry first + i
+    const size_t n_branches = branch_names.size();
+    Bool_t value = false;
+    for (size_t j = 0; j < n_branches; ++j) {
+        TBranch* branch = tree->GetBranch(branch_names[j].c_str());
+        branch->SetAddress(&value);
+        for (Long64_t i = 0; i < n_entries; ++i) {
+            branch->GetEntry(first + i);
+            flags[i * n_branches + j] = value;
+        }
+        branch->ResetAddress();
+    }
+}
+
+void split_trees_read_index(TTree* tree,
+                            const char* branch_name,
+                            Long64_t first,
+                            Long64_t n_entries,
+                            Int_t* indices) {
+    TBranch* branch = tree->GetBranch(branch_name);
+    Int_t value = -1;
+    branch->SetAddress(&value);
+    for (Long64_t i = 0; i < n_entries; ++i) {
+        branch->GetEntry(first + i);
+        indices[i] = value;
+    }
+    branch->ResetAddress();
+}
+"""
+)
+
+# Each input entry is read once and filled into the output tree of its model
+ROOT.gInterpreter.Declare(
+    """
+void split_trees_fan_out(TTree* tree,
+                         const std::vector<TTree*>& outputs,
+                         const Long64_t* entries,
+                         const Int_t* models,
+                         Long64_t n) {
+    // entries are sorted, models[k] is the output that gets entries[k]
+    Long64_t current = -1;
+    for (Long64_t k = 0; k < n; ++k) {
+        if (entries[k] != current) {
+            current = entries[k];
+            tree->GetEntry(current);
+        }
+        outputs[models[k]]->Fill();
+    }
+}
+"""
+)
+
+# The clusters whose entries all go to one model are copied basket by basket, the
+# same way as TTreeCloner, which only copies whole trees
+ROOT.gInterpreter.Declare(
+    """
+std::vector<Long64_t> split_trees_cluster_bounds(TTree* tree) {
+    // First entry of each cluster, followed by the number of entries
+    std::vector<Long64_t> bounds;
+    TTree::TClusterIterator clusters = tree->GetClusterIterator(0);
+    Long64_t start;
+    while ((start = clusters.Next()) < tree->GetEntries()) {
+        bounds.push_back(start);
+    }
+    bounds.push_back(tree->GetEntries());
+    return bounds;
+}
+
+// TBranch::AddBasket does not set the first entry of the next basket filled
+struct split_trees_branch : public TBranch {
+    void start_write_basket() {
+        if (fWriteBasket >= fMaxBaskets) {
+            ExpandBasketArrays();
+        }
+        fBasketEntry[fWriteBasket] = fEntryNumber;
+    }
+};
+
+bool split_trees_find_baskets(TBranch* branch,
+                              Long64_t start,
+                              Long64_t end,
+                              Int_t& first,
+                              Int_t& last) {
+    // Baskets [first, last) of branch hold exactly the entries [start, end)
+    const Int_t n_baskets = branch->GetWriteBasket();
+    const Long64_t* basket_entry = branch->GetBasketEntry();
+    first = -1;
+    last = -1;
+    for (Int_t i = 0; i < n_baskets; ++i) {
+        if (basket_entry[i] == start) first = i;
+        if (basket_entry[i] == end) last = i;
+    }
+    if (end == branch->GetEntries()) last = n_baskets;
+    if (first < 0 || last <= first) return false;
+    for (Int_t i = first; i < last; ++i) {
+        if (branch->GetBasketSeek(i) == 0) return false;
+    }
+    return true;
+}
+
+bool split_trees_copy_cluster(TTree* tree,
+                              TTree* output,
+                              Long64_t start,
+                              Long64_t end) {
+    // Append the entries [start, end) of tree to output without decompressing
+    // them. Returns false and leaves output untouched if the baskets of a
+    // branch do not start and end with the cluster.
+    TObjArray* branches = output->GetListOfBranches();
+    const Int_t n_branches = branches->GetEntriesFast();
+    std::vector<TBranch*> inputs(n_branches);
+    std::vector<Int_t> firsts(n_branches), lasts(n_branches);
+    for (Int_t b = 0; b < n_branches; ++b) {
+        TBranch* to = (TBranch*)branches->UncheckedAt(b);
+        inputs[b] = tree->GetBranch(to->GetName());
+        if (!inputs[b] || inputs[b]->GetListOfBranches()->GetEntriesFast() ||
+            !split_trees_find_baskets(inputs[b], start, end, firsts[b], lasts[b])) {
+            return false;
+        }
+    }
+    TFile* file_in = tree->GetCurrentFile();
+    TFile* file_out = output->GetCurrentFile();
+    for (Int_t b = 0; b < n_branches; ++b) {
+        TBranch* from = inputs[b];
+        TBranch* to = (TBranch*)branches->UncheckedAt(b);
+        // Write the entries filled so far, so that the copied baskets follow them
+        TBasket* current = (TBasket*)to->GetListOfBaskets()->UncheckedAt(
+            to->GetWriteBasket());
+        if (current && current->GetNevBuf()) {
+            to->FlushOneBasket(to->GetWriteBasket());
+        } else if (current) {
+            to->DropBaskets("all");
+        }
+        TBasket* basket = output->CreateBasket(to);
+        for (Int_t i = firsts[b]; i < lasts[b]; ++i) {
+            Long64_t seek = from->GetBasketSeek(i);
+            Int_t n_bytes = from->GetBasketBytes()[i];
+            if (n_bytes == 0) n_bytes = basket->ReadBasketBytes(seek, file_in);
+            basket->LoadBasketBuffers(seek, n_bytes, file_in, tree);
+            basket->CopyTo(file_out);
+            to->AddBasket(*basket, kTRUE,
+                          output->GetEntries() + from->GetBasketEntry()[i] - start);
+        }
+        delete basket;
+        static_cast<split_trees_branch*>(to)->start_write_basket();
+    }
+    output->SetEntries(output->GetEntries() + end - start);
+    return true;
+}
+"""
+)
 
 
 def get_args():
@@ -23,7 +203,7 @@ def get_args():
         "-o",
         "--output",
         type=str,
-        required=True,
+        default=None,
         help="Destination for the final output files. E.g., ",
     )
     parser.add_argument(
@@ -32,7 +212,32 @@ def get_args():
         default=False,
         help="If activated, run hadd over split chunks to get merged .root files.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of input files split in parallel, and of scan points merged "
+        "in parallel with --hadd.",
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=None,
+        help="JSON file with the entries of each model in each input file. Inputs "
+        "found in it with the same size and modification date are not scanned "
+        "again, the others are scanned and added to it.",
+    )
+    parser.add_argument(
+        "--counts",
+        action="store_true",
+        help="Only print the number of events of each model in the inputs, "
+        "without splitting them. Use it with --index to avoid reading the Events.",
+    )
+    args = parser.parse_args()
+    if not args.output and not args.counts:
+        parser.error("the following arguments are required: -o/--output")
+    return args
 
 
 def get_input_files(input):
@@ -56,9 +261,69 @@ def get_gen_models_from_runs(file_in):
     ]
 
 
-def get_event_list_per_model(f_in):
-    # Create a dictionary with the event list for each model
-    event_list_per_model = {}
+def get_model_labels_from_runs(file_in):
+    """
+    Dictionary {genModelIndex value: model label} from the genModelIndex_<label>
+    branches that GenWeightsTablePreSkimProducer writes with storeModelIndex
+    """
+    runs_tree = file_in.Get("Runs")
+    leaves = [
+        branch.GetLeaf(branch.GetName())
+        for branch in runs_tree.GetListOfBranches()
+        if branch.GetName().startswith("genModelIndex_")
+    ]
+    labels = {}
+    for i in range(runs_tree.GetEntries()):
+        runs_tree.GetEntry(i)
+        for leaf in leaves:
+            # Merged files have 0 in the entries of inputs without the model
+            index = int(leaf.GetValue())
+            if index:
+                labels[index] = leaf.GetName().replace("genModelIndex_", "")
+    return labels
+
+
+def get_entries_from_flags(tree, n_events, models):
+    """Entries of each model, from one GenModel_<label> branch per model"""
+    # Read the flags of all models in chunks of events, one column per model,
+    # and keep the entries where each flag is set
+    branch_names = ROOT.std.vector("std::string")()
+    for model in models:
+        branch_names.push_back("GenModel_" + model)
+    chunks_per_model = dict((model, []) for model in models)
+    for first in tqdm(
+        range(0, n_events, SCAN_CHUNK_SIZE), desc="Scanning events", unit="chunks"
+    ):
+        n_chunk = min(SCAN_CHUNK_SIZE, n_events - first)
+        flags = numpy.zeros((n_chunk, len(models)), dtype=numpy.uint8)
+        ROOT.split_trees_read_flags(tree, branch_names, first, n_chunk, flags)
+        rows, columns = numpy.nonzero(flags)
+        for j in numpy.unique(columns):
+            chunks_per_model[models[j]].append(rows[columns == j] + first)
+    return chunks_per_model
+
+
+def get_entries_from_index(tree, n_events, labels):
+    """Entries of each model, from the genModelIndex column"""
+    chunks_per_model = dict((model, []) for model in labels.values())
+    for first in tqdm(
+        range(0, n_events, SCAN_CHUNK_SIZE), desc="Scanning events", unit="chunks"
+    ):
+        n_chunk = min(SCAN_CHUNK_SIZE, n_events - first)
+        indices = numpy.zeros(n_chunk, dtype=numpy.int32)
+        ROOT.split_trees_read_index(tree, "genModelIndex", first, n_chunk, indices)
+        # Group the entries by index, keeping them sorted within each group
+        order = numpy.argsort(indices, kind="mergesort")
+        values, starts = numpy.unique(indices[order], return_index=True)
+        for value, rows in zip(values, numpy.split(order, starts[1:])):
+            if value in labels:
+                chunks_per_model[labels[value]].append(rows + first)
+    return chunks_per_model
+
+
+def get_entries_per_model(f_in):
+    # Create a dictionary with the entries of each model
+    entries_per_model = {}
 
     # Get the number of events in the input file
     tree = f_in.Get("Events")
@@ -66,7 +331,7 @@ def get_event_list_per_model(f_in):
 
     # If there are no events, return an empty dictionary
     if n_events == 0:
-        return event_list_per_model
+        return entries_per_model
 
     # Check if the tree has any GenModel branches
     branches = [key.GetName() for key in tree.GetListOfBranches()]
@@ -74,53 +339,247 @@ def get_event_list_per_model(f_in):
         branch.replace("GenModel_", "") for branch in branches if "GenModel" in branch
     ]
 
-    # If there are no GenModel branches, return an empty dictionary
-    if len(genmodel_branches) == 0:
-        return event_list_per_model
+    if "genModelIndex" in branches:
+        chunks_per_model = get_entries_from_index(
+            tree, n_events, get_model_labels_from_runs(f_in)
+        )
+    elif genmodel_branches:
+        chunks_per_model = get_entries_from_flags(tree, n_events, genmodel_branches)
+    else:
+        # If there are no GenModel branches, return an empty dictionary
+        return entries_per_model
+
+    for model, chunks in chunks_per_model.items():
+        if chunks:
+            entries_per_model[model] = numpy.concatenate(chunks).astype(numpy.int64)
+        else:
+            entries_per_model[model] = numpy.zeros(0, dtype=numpy.int64)
+
+    return entries_per_model
+
+
+def entries_to_ranges(entries):
+    """Sorted entry numbers to a list of [first, last + 1] ranges of consecutive entries"""
+    if len(entries) == 0:
+        return []
+    breaks = numpy.flatnonzero(numpy.diff(entries) != 1)
+    starts = entries[numpy.concatenate(([0], breaks + 1))]
+    stops = entries[numpy.concatenate((breaks, [len(entries) - 1]))] + 1
+    return [[int(start), int(stop)] for start, stop in zip(starts, stops)]
+
+
+def ranges_to_entries(ranges):
+    """Inverse of entries_to_ranges"""
+    if not ranges:
+        return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(
+        [numpy.arange(start, stop, dtype=numpy.int64) for start, stop in ranges]
+    )
 
-    # Initialize the entry list for each model
-    for model in genmodel_branches:
-        event_list_per_model[model] = ROOT.TEntryList(model, model)
 
-    # Turn off all branches except GenModel to speed up the process
-    tree.SetBranchStatus("*", 0)
-    tree.SetBranchStatus("GenModel*", 1)
+def load_index(path):
+    """Read the index of entries per model, {input file: index entry}"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
 
-    # Loop over all events and fill the entry list for each model
-    for n_event in tqdm(xrange(n_events), desc="Scanning events", unit="Events"):  # type: ignore [name-defined]
-        tree.GetEntry(n_event)
-        for model in genmodel_branches:
-            if getattr(tree, "GenModel_" + model):
-                event_list_per_model[model].Enter(n_event)
 
-    tree.SetBranchStatus("*", 1)
-    return event_list_per_model
+def save_index(path, index):
+    """Write the index of entries per model, replacing the old file only once complete"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, sort_keys=True)
+    os.rename(tmp_path, path)
 
 
-def copy_runs_tree(tree_in, model):
+def get_indexed_entries(f_in, index_entry):
     """
-    This seems to work although ROOT people say it is not possible.
+    Entries of each model, from the index entry of the file if it is still valid
+    or from the Events tree otherwise. Returns the entries and the up to date
+    index entry {"size", "mtime", "models": {model: ranges}}.
     """
-    tree_in.SetBranchStatus("*SUEP*", 0)
-    tree_in.SetBranchStatus("*" + model, 1)
-    tree_out = tree_in.CopyTree("1")
-    for branch in tree_out.GetListOfBranches():
-        if branch.GetName().endswith(model):
-            branch.SetName(branch.GetName().replace("_" + model, ""))
-            branch.SetTitle(
-                branch.GetTitle()
-                .replace(", for model label " + model, "")
-                .replace("_" + model, "")
+    size = f_in.GetSize()
+    mtime = f_in.GetModificationDate().Convert()
+    if index_entry and index_entry["size"] == size and index_entry["mtime"] == mtime:
+        entries_per_model = dict(
+            (model, ranges_to_entries(ranges))
+            for model, ranges in index_entry["models"].items()
+        )
+        return entries_per_model, index_entry
+
+    entries_per_model = get_entries_per_model(f_in)
+    index_entry = {
+        "size": size,
+        "mtime": mtime,
+        "models": dict(
+            (model, entries_to_ranges(entries))
+            for model, entries in entries_per_model.items()
+        ),
+    }
+    return entries_per_model, index_entry
+
+
+def count_events(input_files, index):
+    """Print the number of events of each model in the input files"""
+    counts = {}
+    for input_file in input_files:
+        f_in = ROOT.TFile.Open(input_file, "read")
+        entries_per_model, index[input_file] = get_indexed_entries(
+            f_in, index.get(input_file)
+        )
+        f_in.Close()
+        for model, entries in entries_per_model.items():
+            counts[model] = counts.get(model, 0) + len(entries)
+    for model in sorted(counts):
+        print("{} {}".format(model, counts[model]))
+
+
+def get_runs_plan(tree_in, gen_models):
+    """
+    Decide once per input which Runs branches go to the output of each model. The
+    branches without a model label go to all of them, the <name>_<model> ones only
+    to the output of their model, renamed to <name>, and the other branches with
+    SUEP in their name are dropped. Returns a dictionary
+    {model: [(input name, output name, output title), ...]}.
+    """
+    models = set(gen_models)
+    common = []
+    per_model = dict((model, []) for model in gen_models)
+    for branch in tree_in.GetListOfBranches():
+        name = branch.GetName()
+        # The model labels contain underscores, so try every split of the name
+        model = None
+        for i, c in enumerate(name):
+            if c == "_" and name[i + 1 :] in models:
+                model = name[i + 1 :]
+                break
+        if model is None:
+            if "SUEP" not in name:
+                common.append((name, name, branch.GetTitle()))
+            continue
+        title = (
+            branch.GetTitle()
+            .replace(", for model label " + model, "")
+            .replace("_" + model, "")
+        )
+        per_model[model].append((name, name[: -len(model) - 1], title))
+    return dict((model, common + per_model[model]) for model in gen_models)
+
+
+def get_owned_clusters(tree_in, models, entries_per_model):
+    """
+    Clusters of the input whose entries all belong to one or more of models, as a
+    list of (first entry, end entry, [indices in models of the owners])
+    """
+    bounds = numpy.fromiter(ROOT.split_trees_cluster_bounds(tree_in), dtype=numpy.int64)
+    owners = [[] for _ in range(len(bounds) - 1)]
+    for j, model in enumerate(models):
+        entries = numpy.sort(
+            numpy.asarray(entries_per_model.get(model, []), dtype=numpy.int64)
+        )
+        # Entries of a model are unique, so a cluster belongs to it if the model
+        # has as many entries in it as the cluster has
+        counts = numpy.diff(numpy.searchsorted(entries, bounds))
+        for c in numpy.nonzero(counts == numpy.diff(bounds))[0]:
+            owners[c].append(j)
+    return [
+        (int(bounds[c]), int(bounds[c + 1]), owners[c])
+        for c in range(len(owners))
+        if owners[c]
+    ]
+
+
+def fill_entries(tree_in, trees_out, entries, indices):
+    """Fill entries[k] of tree_in into trees_out[indices[k]], for sorted entries"""
+    if len(entries):
+        entries = numpy.ascontiguousarray(entries)
+        indices = numpy.ascontiguousarray(indices)
+        ROOT.split_trees_fan_out(tree_in, trees_out, entries, indices, len(entries))
+
+
+def fan_out_events(tree_in, outputs, entries_per_model, memory=FAN_OUT_MEMORY):
+    """
+    Write the Events of each model into its output file. A model that has all the
+    entries of the input is fast cloned basket by basket, without decompressing
+    them. The clusters of the input whose entries all go to a model are also
+    copied basket by basket, and the other entries are written in a single pass
+    over the input. outputs is a dictionary {model: output file}. memory is the
+    number of bytes of baskets the output trees keep in memory together.
+    """
+    n_entries = tree_in.GetEntries()
+
+    # Drop all GenModel branches and the model index, constant in each output
+    tree_in.SetBranchStatus("GenModel*", 0)
+    if tree_in.GetListOfBranches().FindObject("genModelIndex"):
+        tree_in.SetBranchStatus("genModelIndex", 0)
+
+    # Entries of a model are unique, so it has them all if it has n_entries
+    models = []
+    for model in outputs:
+        if n_entries > 0 and len(entries_per_model.get(model, [])) == n_entries:
+            outputs[model].cd()
+            tree_out = tree_in.CloneTree(-1, "fast")
+            outputs[model].WriteTObject(tree_out, "Events", "Overwrite")
+        else:
+            models.append(model)
+
+    # The output trees allocate all their baskets with the first entry, so the
+    # baskets are shrunk to share the memory as well as the flushes
+    trees_out = ROOT.std.vector("TTree*")()
+    for model in models:
+        outputs[model].cd()
+        tree_out = tree_in.CloneTree(0)
+        tree_out.SetAutoFlush(-max(1000**2, memory // len(models)))
+        n_branches = max(1, tree_out.GetListOfBranches().GetEntries())
+        tree_out.SetBasketSize(
+            "*", max(FAN_OUT_MIN_BASKET_SIZE, memory // (len(models) * n_branches))
+        )
+        trees_out.push_back(tree_out)
+
+    # Pairs (entry, output index) sorted by entry, so that each entry is read once
+    # even if it belongs to several models
+    entries = [entries_per_model.get(model, []) for model in models]
+    indices = [numpy.full(len(e), j, dtype=numpy.int32) for j, e in enumerate(entries)]
+    if models:
+        entries = numpy.concatenate(entries).astype(numpy.int64)
+        indices = numpy.concatenate(indices)
+        order = numpy.argsort(entries, kind="mergesort")
+        entries = numpy.ascontiguousarray(entries[order])
+        indices = numpy.ascontiguousarray(indices[order])
+        if len(entries):
+            # Prefetch only the baskets between the first and last entry needed
+            tree_in.SetCacheSize(FAN_OUT_CACHE_SIZE)
+            tree_in.AddBranchToCache("*", True)
+            tree_in.SetCacheEntryRange(int(entries[0]), int(entries[-1]) + 1)
+        done = 0
+        for start, end, owners in get_owned_clusters(
+            tree_in, models, entries_per_model
+        ):
+            first, last = numpy.searchsorted(entries, [start, end])
+            fill_entries(tree_in, trees_out, entries[done:first], indices[done:first])
+            copied = [
+                j
+                for j in owners
+                if ROOT.split_trees_copy_cluster(tree_in, trees_out[j], start, end)
+            ]
+            keep = ~numpy.isin(indices[first:last], copied)
+            fill_entries(
+                tree_in, trees_out, entries[first:last][keep], indices[first:last][keep]
             )
-            for leaf in branch.GetListOfLeaves():
-                leaf.SetName(leaf.GetName().replace("_" + model, ""))
-                leaf.SetTitle(leaf.GetTitle().replace("_" + model, ""))
-    return tree_out
+            done = last
+        fill_entries(tree_in, trees_out, entries[done:], indices[done:])
 
+    for model, tree_out in zip(models, trees_out):
+        outputs[model].WriteTObject(tree_out, "Events", "Overwrite")
 
-def splitting(args, input_file):
+    tree_in.SetBranchStatus("*", 1)
+
+
+def splitting(args, input_file, index_entry=None):
     """
     Split one input file into multiple output files based on the gen models found.
+    Returns the gen models and the index entry of the file.
     """
     # Load input file and get list of keys
     f_in = ROOT.TFile.Open(input_file, "read")
@@ -130,52 +589,72 @@ def splitting(args, input_file):
     gen_models = get_gen_models_from_runs(f_in)
 
     # Get which events correspond to which gen model
-    event_list_per_model = get_event_list_per_model(f_in)
+    entries_per_model, index_entry = get_indexed_entries(f_in, index_entry)
 
-    # For each gen model, create a new file with the corresponding entries
-    for model in tqdm(gen_models, desc="Saving models", unit="files"):
+    # Create one output file per gen model, all filled at the same time
+    outputs = {}
+    for model in gen_models:
         output_file_name = os.path.join(
             args.output,
             os.path.basename(input_file).replace(".root", "_%s.root" % model),
         )
-        f_out = ROOT.TFile.Open(output_file_name, "recreate")
-        for key in keys:
-            if key == "Events":
-                tree_in = f_in.Get(key)
-
-                if tree_in.GetEntriesFast() > 0:
-                    # Drop all GenModel branches
-                    tree_in.SetBranchStatus("GenModel*", 0)
-
-                    # Keep only the events corresponding to the model
-                    if model in event_list_per_model:
-                        tree_in.SetEntryList(event_list_per_model[model])
-                    else:
-                        tree_in.SetEntryList(ROOT.TEntryList())
-
-                tree_out = tree_in.CopyTree("1")
-                f_out.WriteTObject(tree_out, key, "Overwrite")
-            elif key == "Runs":
-                tree_in = f_in.Get(key)
-                tree_out = copy_runs_tree(tree_in, model)
-                f_out.WriteTObject(tree_out, key, "Overwrite")
-            elif key == "LuminosityBlocks":
-                tree_in = f_in.Get(key)
+        outputs[model] = ROOT.TFile.Open(output_file_name, "recreate")
+
+    for key in keys:
+        if key == "Events":
+            # Parallel jobs share the memory budget
+            fan_out_events(
+                f_in.Get(key), outputs, entries_per_model, FAN_OUT_MEMORY // args.jobs
+            )
+        elif key == "Runs":
+            tree_in = f_in.Get(key)
+            runs = read_runs(tree_in)
+            plan = get_runs_plan(tree_in, gen_models)
+            for model in tqdm(gen_models, desc="Saving Runs", unit="files"):
+                outputs[model].cd()
+                tree_out = write_runs_tree(runs, plan[model])
+                outputs[model].WriteTObject(tree_out, key, "Overwrite")
+        elif key == "LuminosityBlocks":
+            tree_in = f_in.Get(key)
+            for model in gen_models:
+                outputs[model].cd()
                 tree_out = tree_in.CloneTree(-1, "fast")
-                f_out.WriteTObject(tree_out, key, "Overwrite")
+                outputs[model].WriteTObject(tree_out, key, "Overwrite")
 
+    for f_out in outputs.values():
         f_out.Close()
 
     f_in.Close()
 
-    return gen_models
+    return gen_models, index_entry
+
+
+def split_task(task):
+    """Split one input file in a worker process"""
+    args, input_file, index_entry = task
+    return input_file, splitting(args, input_file, index_entry)
 
 
-def split_wrapper(args, input_files):
+def split_wrapper(args, input_files, index):
+    """Split all input files, updating the index with their entries per model"""
     all_scan_points = set()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(input_files)) or 1)
+        tasks = [(args, f, index.get(f)) for f in input_files]
+        results = pool.imap_unordered(split_task, tasks)
+        for i, (input_file, (scan_points, index_entry)) in enumerate(results, 1):
+            print("Split {}/{} files".format(i, len(input_files)))
+            all_scan_points.update(scan_points)
+            index[input_file] = index_entry
+        pool.close()
+        pool.join()
+        return all_scan_points
     for i, input_file in enumerate(input_files, 1):
         print("Splitting file {}/{}: {}".format(i, len(input_files), input_file))
-        all_scan_points.update(splitting(args, input_file))
+        scan_points, index[input_file] = splitting(
+            args, input_file, index.get(input_file)
+        )
+        all_scan_points.update(scan_points)
     return all_scan_points
 
 
@@ -197,8 +676,11 @@ def hadd_files(args, scan_point):
 def merge_wrapper(args, all_scan_points):
     if not args.hadd:
         return
-    for scan_point in all_scan_points:
-        hadd_files(args, scan_point)
+    # Each merge runs in its own haddnano.py process, threads only wait for them
+    pool = multiprocessing.pool.ThreadPool(args.jobs)
+    pool.map(lambda scan_point: hadd_files(args, scan_point), sorted(all_scan_points))
+    pool.close()
+    pool.join()
 
 
 if __name__ == "__main__":
@@ -207,12 +689,23 @@ if __name__ == "__main__":
     # Get input files
     input_files = get_input_files(args.input)
 
+    # Entries per model of the inputs split or counted before
+    index = load_index(args.index)
+
+    if args.counts:
+        count_events(input_files, index)
+        if args.index:
+            save_index(args.index, index)
+        sys.exit(0)
+
     # Make sure the output directory exists
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
     # Split the input files
-    all_scan_points = split_wrapper(args, input_files)
+    all_scan_points = split_wrapper(args, input_files, index)
+    if args.index:
+        save_index(args.index, index)
 
     # Merge the output files
     merge_wrapper(args, all_scan_points)
@@ -2,119 +2,56 @@
 Run this script to split the signal files.
 """
 
-import subprocess
 import argparse
 import os
 import time
 import sys
 import json
+import collections
+import multiprocessing
+import condor_utils
+import storage
 
 
-def eos_ls(args, directory):
-    """List contents of a directory on EOS"""
-    max_retries = 3
-    retry_delay = 1  # seconds
-
-    for attempt in range(max_retries):
-        try:
-            command = "source ~/.bash_profile 2>/dev/null; eos {} ls {}".format(
-                args.redirector, directory
-            )
-            result = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                executable="/bin/bash",
-            )
-            out, err = result.communicate()
-            # If error occurred or output is empty, try again
-            if err or not out:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                return []
-            return [x for x in out.decode("utf-8").strip().split("\n") if x]
-        except:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                continue
-            return []
-    return []
-
-
-def get_datasets_and_files(input_path, list_of_datasets):
+def get_datasets_and_files(args, list_of_datasets):
     """
     Get all datasets and their ROOT files in a single pass.
-    Returns a dictionary {dataset_dir: [root_files]}
+    Returns a dictionary {dataset_dir: {root_file: size in bytes}}
     """
-    print("Scanning input directory: {}".format(input_path))
-    dataset_files = {}
+    print("Scanning input directory: {}".format(args.input))
+
+    # Scan all dataset directories together
+    dataset_paths = [os.path.join(args.input, dataset) for dataset in list_of_datasets]
+    cache = storage.open_cache(args)
+    try:
+        found = storage.find_root_files(
+            args.backend,
+            dataset_paths,
+            workers=args.workers,
+            verbose=args.verbose,
+            cache=cache,
+            allow_missing=args.allow_missing,
+        )
+    except storage.StorageError as e:
+        # Planning the jobs without them would silently leave their files out
+        print("{}. Use --allow_missing to go on without them.".format(e))
+        sys.exit(1)
+    finally:
+        if cache:
+            cache.close()
 
-    # Process each potential dataset directory
-    for i, dataset in enumerate(list_of_datasets, 1):
-        print("Scanning {} {}/{}".format(dataset, i, len(list_of_datasets)))
-        dataset_path = os.path.join(args.input, dataset)
-        files = get_root_files_recursive(args, dataset_path)
+    dataset_files = {}
+    for dataset_path in dataset_paths:
+        files = found[dataset_path]
         if files:  # Only include directories that have ROOT files
-            dataset_files[dataset_path] = files
-            print("  -> Found {} ROOT files".format(len(files)))
+            dataset_files[dataset_path] = collections.OrderedDict(files)
+            print("  {} -> Found {} ROOT files".format(dataset_path, len(files)))
         else:
-            print("  -> No ROOT files found")
+            print("  {} -> No ROOT files found".format(dataset_path))
 
     return dataset_files
 
 
-def get_root_files_recursive(args, directory):
-    """Recursively get all .root files from a directory"""
-    if args.verbose:
-        print("  Scanning {}".format(directory))
-
-    # Skip if this is a log directory
-    if "/log" in directory:
-        return []
-
-    result = []
-    contents = eos_ls(args, directory)
-
-    for item in contents:
-        if not item:  # Skip empty strings
-            continue
-
-        full_path = os.path.join(directory, item)
-
-        # Skip log directories
-        if item == "log":
-            continue
-
-        if item.endswith(".root"):
-            result.append(full_path)
-            if args.verbose:
-                print("    Found ROOT file: {}".format(item))
-        else:
-            # Try to list the item - if it succeeds and returns content, it's a directory
-            subdir_contents = eos_ls(args, full_path)
-            if subdir_contents:  # Only recurse if we got valid contents
-                result.extend(get_root_files_recursive(args, full_path))
-
-    return result
-
-
-def eos_file_size(args, file_path):
-    """Get the size of a file on EOS in bytes"""
-    command = "eos {} stat {}".format(args.redirector, file_path)
-    result = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, executable="/bin/bash"
-    )
-    out, err = result.communicate()
-    next_one = False
-    for item in out.decode("utf-8").strip().split(" "):
-        if next_one:
-            return int(item)
-        if item == "Size:":
-            next_one = True
-
-
 def get_args():
     parser = argparse.ArgumentParser(
         description="Merge files from different directories recursively"
@@ -145,11 +82,37 @@ def get_args():
         default=0.3,
         help="Maximum total file size of to process per job in GB",
     )
+    parser.add_argument(
+        "--target_runtime",
+        type=float,
+        default=None,
+        help="Target runtime of the jobs in minutes. If given, the files are grouped "
+        "by their estimated splitting time, from the number of events and of models "
+        "read from the file metadata, instead of by size with --max_size.",
+    )
+    parser.add_argument(
+        "--seconds_per_event",
+        type=float,
+        default=0.005,
+        help="Estimated splitting time per event for --target_runtime. Measure it "
+        "with benchmark_merge_split.py (the inverse of split_evt_s).",
+    )
+    parser.add_argument(
+        "--seconds_per_model",
+        type=float,
+        default=2.0,
+        help="Estimated splitting time per model and input file for --target_runtime "
+        "(output file, Runs tree and merge of each model)",
+    )
+    condor_utils.add_packing_arguments(parser)
+    condor_utils.add_sandbox_arguments(parser)
     parser.add_argument(
         "--redirector",
         type=str,
         default="root://cmseos.fnal.gov/",
-        help="EOS redirector for the input files",
+        help="Redirector URL of the storage: root://<host>/ (XRootD python bindings, "
+        "or the eos command if they are missing), eos://<host>/ (eos command) or "
+        "file:// (local directories)",
     )
     parser.add_argument(
         "--memory",
@@ -157,6 +120,20 @@ def get_args():
         default=5000,
         help="Memory request for condor jobs in MB",
     )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=1,
+        help="Number of cores to request for condor jobs. split_trees.py uses all of them.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of directories listed in parallel when scanning the input",
+    )
+    storage.add_cache_arguments(parser)
+    storage.add_listing_arguments(parser)
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -168,10 +145,12 @@ def get_args():
         help="Use JSON file format for datasets. The code will keep only the primary part "
         "of the dataset name if the provide datasets follow the DAS naming conventions.",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.backend = storage.get_backend(args.redirector)
+    return args
 
 
-def create_condor_script(args, dataset_dir, files, max_size, work_dir, cmssw_version):
+def create_condor_script(args, dataset_dir, file_sizes, max_size, work_dir, sandbox):
     """Create a condor submission script and executable for this dataset"""
     dataset_name = os.path.basename(dataset_dir)
 
@@ -180,7 +159,7 @@ def create_condor_script(args, dataset_dir, files, max_size, work_dir, cmssw_ver
         os.makedirs(work_dir_dataset)
 
     # Write the split file lists
-    n_jobs = split_files_for_jobs(files, max_size, args, work_dir_dataset)
+    n_jobs = split_files_for_jobs(file_sizes, max_size, args, work_dir_dataset)
 
     # Write split script
     split_script = os.path.join(work_dir_dataset, "split.sh")
@@ -204,22 +183,11 @@ echo "Running merge for $dataset_name job ${{job_id}}"
 echo "Contents of working directory:"
 ls -la
 
-# Move to a tmp dir to avoid conflicts
-tmp_dir=$(mktemp -d -p .)
-cd $tmp_dir
-tar -xf ../{cmssw_version}.tar.gz
-rm ../{cmssw_version}.tar.gz
-export SCRAM_ARCH=slc7_amd64_gcc700
-if [ ! -d {cmssw_version}/src ]; then
-    mkdir -p {cmssw_version}/src
-fi
-mv ../files_${{job_id}}.txt ../haddnano.py ../split_trees.py {cmssw_version}/src
-cd {cmssw_version}/src
-eval $(scramv1 runtime -sh) # cmsenv is an alias not on the workers
+{setup}
 
 # Do the splitting
 mkdir output
-python split_trees.py -i files_${{job_id}}.txt -o output --hadd
+python split_trees.py -i files_${{job_id}}.txt -o output --hadd --jobs {cpus}
 
 # Check if merge was successful
 if [ $? -ne 0 ]; then
@@ -245,16 +213,14 @@ echo "Cleaning up"
 rm -rf output
 echo "Job completed successfully"
 """.format(
-                redirector=args.redirector,
+                redirector=args.backend.redirector,
                 output_dir=args.output,
-                cmssw_version=cmssw_version,
+                setup=sandbox.setup_commands(["files_${job_id}.txt"]),
+                cpus=args.cpus,
             )
         )
     os.chmod(split_script, 0o755)
 
-    # Get CMSSW tarball name
-    cmssw_tarball = "{}.tar.gz".format(cmssw_version)
-
     # Create the condor submit file
     submit_file = os.path.join(work_dir_dataset, "submit.jdl")
     with open(submit_file, "w") as f:
@@ -268,13 +234,14 @@ error = {work_dir_dataset}/$(ClusterId).$(ProcId).stderr
 log = {work_dir_dataset}/$(ClusterId).$(ProcId).log
 
 # Transfer files
-transfer_input_files = {work_dir_dataset}/files_$(ProcId).txt,split_trees.py,haddnano.py,{cmssw_tarball}
+transfer_input_files = {work_dir_dataset}/files_$(ProcId).txt,{sandbox_files}
 should_transfer_files = YES
 when_to_transfer_output = ON_EXIT
 
 # Requirements and resources
 x509userproxy = $ENV(X509_USER_PROXY)
 request_memory = {memory}
+request_cpus = {cpus}
 +REQUIRED_OS = "rhel7"
 +DesiredOS = REQUIRED_OS
 
@@ -306,87 +273,111 @@ queue {n_jobs}
                 executable=split_script,
                 work_dir_dataset=work_dir_dataset,
                 n_jobs=n_jobs,
-                cmssw_tarball=cmssw_tarball,
+                sandbox_files=",".join(sandbox.files),
                 dataset_name=dataset_name,
                 memory=args.memory,
+                cpus=args.cpus,
             )
         )
 
     return submit_file
 
 
-def split_files_for_jobs(files, max_size, args, work_dir):
-    """Split files into groups based on size"""
-    groups = []
-    current_group = []
-    current_size = 0
+def get_split_work(url):
+    """
+    Number of events and of models of a file, from the Events and Runs tree
+    headers only, or None if the file cannot be opened
+    """
+    import ROOT  # type: ignore [import]
+
+    f = ROOT.TFile.Open(url, "read")
+    if not f or f.IsZombie():
+        return url, None
+    events = f.Get("Events")
+    runs = f.Get("Runs")
+    n_events = events.GetEntries() if events else 0
+    n_models = 0
+    if runs:
+        n_models = len(
+            [b for b in runs.GetListOfBranches() if "genEventCount_" in b.GetName()]
+        )
+    f.Close()
+    return url, (n_events, n_models)
+
+
+def estimate_runtimes(args, files):
+    """Estimated splitting time of each file in seconds, {file: seconds}"""
+    urls = dict((args.backend.redirector + f, f) for f in files)
+    pool = multiprocessing.Pool(args.workers)
+    runtimes = {}
+    for url, work in pool.imap_unordered(get_split_work, list(urls)):
+        if work is None:
+            print("  Cannot read {}, giving it a job of its own".format(url))
+            runtimes[urls[url]] = args.target_runtime * 60 * args.cpus
+            continue
+        n_events, n_models = work
+        runtimes[urls[url]] = (
+            n_events * args.seconds_per_event + n_models * args.seconds_per_model
+        )
+    pool.close()
+    pool.join()
+    return runtimes
 
-    for f in files:
-        size = eos_file_size(args, f)
-        if current_size + size > max_size and current_group:
-            groups.append(current_group)
-            current_group = []
-            current_size = 0
-        current_group.append(f)
-        current_size += size
 
-    if current_group:
-        groups.append(current_group)
+def split_files_for_jobs(file_sizes, max_size, args, work_dir):
+    """
+    Split files into groups based on size, given as {file: size in bytes}, or on
+    their estimated runtime with --target_runtime
+    """
+    if args.target_runtime:
+        # The files of a job are split in parallel on its cores
+        costs = estimate_runtimes(args, list(file_sizes))
+        budget = args.target_runtime * 60 * args.cpus
+    else:
+        costs = file_sizes
+        budget = max_size
+    groups = condor_utils.group_files(
+        list(file_sizes), costs, budget, args.packing, args.min_fill
+    )
+    if args.target_runtime:
+        longest = max(sum(costs[f] for f in group) for group in groups)
+        print(
+            "  -> {} jobs, the longest estimated to take {:.0f} minutes".format(
+                len(groups), longest / 60.0 / args.cpus
+            )
+        )
 
     # Write each group to a separate file
     for i, group in enumerate(groups):
         output_file = os.path.join(work_dir, "files_{}.txt".format(i))
         with open(output_file, "w") as f:
             for file_path in group:
-                f.write(args.redirector + file_path + "\n")
+                f.write(args.backend.redirector + file_path + "\n")
 
     return len(groups)
 
 
-def create_cmssw_tarball():
-    """Create a tarball of the current CMSSW environment"""
-    if not "CMSSW_BASE" in os.environ:
-        print("Please run cmsenv in your CMSSW environment first")
-        sys.exit(1)
-
-    cmssw_base = os.environ["CMSSW_BASE"]
-    cmssw_version = os.path.basename(cmssw_base)
-    tarball = "{}.tar.gz".format(cmssw_version)
-
-    # Check if tarball already exists
-    if os.path.exists(tarball):
-        os.remove(tarball)
-
-    print("Creating CMSSW tarball...")
-    # Get the relative path from where we are to CMSSW_BASE
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(cmssw_base))
-
-    # Create the tarball excluding unnecessary directories
-    cmd = (
-        "tar --exclude-caches-all --exclude-vcs -zcf {cwd}/{version}.tar.gz -C {version}/.. "
-        "{version} --exclude=src --exclude=tmp --exclude=*.tar.gz --exclude=*.root"
-    ).format(cwd=cwd, tarball=tarball, version=cmssw_version)
-    subprocess.check_call(cmd.split())
-    os.chdir(cwd)
-    print(
-        "Created CMSSW tarball: {} of size {} MB".format(
-            tarball, round(os.path.getsize(tarball) / 1000.0**2, 1)
-        )
-    )
-    return tarball, cmssw_version
-
-
 if __name__ == "__main__":
     args = get_args()
 
-    # Check for split_trees.py
-    if not os.path.exists("split_trees.py"):
-        print("Please make sure split_trees.py is in the current directory")
-        sys.exit(1)
+    # Check for the scripts the jobs run
+    for script in ["split_trees.py", "haddnano.py", "nano_trees.py"]:
+        if not os.path.exists(script):
+            print("Please make sure {} is in the current directory".format(script))
+            sys.exit(1)
+
+    # Create a working directory for condor files
+    work_dir = "condor_split_{}".format(time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(work_dir)
 
-    # Create CMSSW tarball
-    cmssw_tarball, cmssw_version = create_cmssw_tarball()
+    # Scripts and environment of the jobs, before the slow scan of the input.
+    # The tarball of --sandbox cmssw leaves out src as before.
+    sandbox = condor_utils.create_sandbox(
+        args,
+        work_dir,
+        ["split_trees.py", "haddnano.py", "nano_trees.py"],
+        excludes=["src"],
+    )
 
     list_of_datasets = []
     if args.json:
@@ -397,14 +388,10 @@ if __name__ == "__main__":
             list_of_datasets = [x.strip() for x in f.readlines()]
 
     # Get all datasets and their files in one pass
-    dataset_files = get_datasets_and_files(args.input, list_of_datasets)
+    dataset_files = get_datasets_and_files(args, list_of_datasets)
 
     print("Found {} datasets to process:".format(len(dataset_files)))
 
-    # Create a working directory for condor files
-    work_dir = "condor_split_{}".format(time.strftime("%Y%m%d-%H%M%S"))
-    os.makedirs(work_dir)
-
     submit_files = []
     for dataset_dir in dataset_files.keys():
         print("  {} ({} files)".format(dataset_dir, len(dataset_files[dataset_dir])))
@@ -416,7 +403,7 @@ if __name__ == "__main__":
             dataset_files[dataset_dir],
             args.max_size * 1000**3,
             work_dir,
-            cmssw_version,
+            sandbox,
         )
         submit_files.append(submit_file)
 
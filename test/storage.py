@@ -0,0 +1,349 @@
+"""
+Helpers to list files on EOS, shared by the scripts that plan condor jobs
+(merge.py and splitter.py) and make_json_from_eos_dir.py. The storage is accessed
+through a backend chosen from the redirector URL, see get_backend.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import time
+from multiprocessing.pool import ThreadPool
+
+# Default location of the cache of directory listings
+DEFAULT_CACHE = os.path.join("~", ".cache", "suepnano", "eos_listings.sqlite")
+
+
+class StorageError(Exception):
+    """A directory could not be listed"""
+
+
+def eos_ls(redirector, directory, options=(), max_retries=3, retry_delay=1):
+    """
+    List the contents of a directory on EOS. An empty directory gives an empty
+    list. A failure, i.e. a non-zero exit code of eos, is retried a few times and
+    then raises a StorageError.
+    """
+    command = ["eos", redirector, "ls"] + list(options) + [directory]
+    for attempt in range(max_retries):
+        try:
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            out, err = process.communicate()
+        except OSError as e:
+            # eos is not installed, no point in retrying
+            raise StorageError("Cannot run eos: {}".format(e))
+        if process.returncode == 0:
+            return [x for x in out.decode("utf-8").split("\n") if x]
+        if attempt < max_retries - 1:
+            time.sleep(retry_delay)
+    raise StorageError(
+        "Cannot list {}: {}".format(directory, err.decode("utf-8").strip())
+    )
+
+
+def parse_long_listing(lines):
+    """
+    Parse the lines of eos ls -l, e.g.
+    -rw-r--r--   1 user  group  2345678 Nov 12 10:31 nano_skim_1.root
+    Returns (files, subdirectories), with files a list of (name, size in bytes)
+    and subdirectories a list of (name, modification time as listed).
+    """
+    files = []
+    subdirectories = []
+    for line in lines:
+        fields = line.split(None, 8)
+        if len(fields) < 9:
+            continue
+        permissions, size, name = fields[0], fields[4], fields[8]
+        if permissions.startswith("d"):
+            subdirectories.append((name, " ".join(fields[5:8])))
+        else:
+            files.append((name, int(size)))
+    return files, subdirectories
+
+
+class EosCliBackend(object):
+    """Storage on EOS, through the eos and xrdcp commands"""
+
+    def __init__(self, redirector):
+        # Prefix that turns a path into the URL given to ROOT and xrdcp
+        self.redirector = redirector
+
+    def list_directory(self, directory):
+        return parse_long_listing(eos_ls(self.redirector, directory, options=["-l"]))
+
+    def read(self, path):
+        process = subprocess.Popen(
+            ["xrdcp", "--silent", self.redirector + path, "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise StorageError("Cannot read {}: {}".format(path, err.decode("utf-8")))
+        return out.decode("utf-8")
+
+
+class XRootDBackend(object):
+    """Storage behind an xrootd redirector, through the XRootD python bindings"""
+
+    def __init__(self, redirector):
+        from XRootD import client  # type: ignore [import]
+
+        self.redirector = redirector
+        self.client = client
+        self.file_system = client.FileSystem(redirector)
+
+    def list_directory(self, directory):
+        from XRootD.client.flags import DirListFlags, StatInfoFlags  # type: ignore [import]
+
+        status, listing = self.file_system.dirlist(directory, DirListFlags.STAT)
+        if not status.ok:
+            raise StorageError("Cannot list {}: {}".format(directory, status.message))
+        files = []
+        subdirectories = []
+        for entry in listing:
+            if entry.statinfo.flags & StatInfoFlags.IS_DIR:
+                subdirectories.append((entry.name, str(entry.statinfo.modtime)))
+            else:
+                files.append((entry.name, entry.statinfo.size))
+        return files, subdirectories
+
+    def read(self, path):
+        with self.client.File() as f:
+            status, _ = f.open(self.redirector + path)
+            if not status.ok:
+                raise StorageError("Cannot read {}: {}".format(path, status.message))
+            status, data = f.read()
+            if not status.ok:
+                raise StorageError("Cannot read {}: {}".format(path, status.message))
+        return data.decode("utf-8")
+
+
+class LocalBackend(object):
+    """Storage on a local (or mounted) file system, e.g. to test the tools offline"""
+
+    redirector = ""
+
+    def list_directory(self, directory):
+        try:
+            names = os.listdir(directory)
+        except OSError as e:
+            raise StorageError("Cannot list {}: {}".format(directory, e))
+        files = []
+        subdirectories = []
+        for name in names:
+            stat = os.stat(os.path.join(directory, name))
+            if os.path.isdir(os.path.join(directory, name)):
+                subdirectories.append((name, str(stat.st_mtime)))
+            else:
+                files.append((name, stat.st_size))
+        return files, subdirectories
+
+    def read(self, path):
+        try:
+            with open(path, "r") as f:
+                return f.read()
+        except IOError as e:
+            raise StorageError("Cannot read {}: {}".format(path, e))
+
+
+def get_backend(url):
+    """
+    The storage backend for a redirector URL: root://host/ uses the XRootD python
+    bindings if they are installed and the eos command otherwise, eos://host/
+    always uses the eos command, and file:// or an empty URL the local file system.
+    """
+    if url.startswith("root://"):
+        try:
+            return XRootDBackend(url)
+        except ImportError:
+            return EosCliBackend(url)
+    if url.startswith("eos://"):
+        return EosCliBackend("root://" + url[len("eos://") :])
+    if url in ("", "file://"):
+        return LocalBackend()
+    raise ValueError("Unknown storage URL {}".format(url))
+
+
+def list_directory(backend, directory):
+    """
+    List a directory once, telling files from subdirectories and getting the size
+    of the files. Returns (files, subdirectories) as parse_long_listing, or None
+    if the directory cannot be listed.
+    """
+    try:
+        return backend.list_directory(directory)
+    except StorageError as e:
+        print("  Warning: {}".format(e))
+        return None
+
+
+def ls(backend, directory):
+    """Names of the files and subdirectories of a directory"""
+    files, subdirectories = backend.list_directory(directory)
+    return sorted([name for name, _ in files] + [name for name, _ in subdirectories])
+
+
+class ListingCache(object):
+    """
+    Directory listings kept in a sqlite database between runs. A listing is used
+    while it is younger than ttl seconds and the modification time of the
+    directory, as seen in the listing of its parent, has not changed. The top
+    directories of a crawl have no parent listing, so they are always listed.
+    A directory whose parent listing also came from the cache is checked against
+    the modification time recorded then, so changes deeper in an unchanged
+    directory are only seen once the ttl expires.
+    """
+
+    def __init__(self, path, ttl):
+        path = os.path.expanduser(path)
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS listings (redirector TEXT, directory TEXT, "
+            "mtime TEXT, fetched REAL, listing TEXT, PRIMARY KEY (redirector, directory))"
+        )
+        self.ttl = ttl
+
+    def get(self, redirector, directory, mtime):
+        """The cached listing of the directory, or None if there is no valid one"""
+        if mtime is None:
+            return None
+        row = self.connection.execute(
+            "SELECT mtime, fetched, listing FROM listings "
+            "WHERE redirector = ? AND directory = ?",
+            (redirector, directory),
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        if row[0] != mtime:
+            return None
+        return json.loads(row[2])
+
+    def put(self, redirector, directory, mtime, listing):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+            (redirector, directory, mtime, time.time(), json.dumps(listing)),
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def add_cache_arguments(parser):
+    """Add the options of the listing cache to the parser of a script"""
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=DEFAULT_CACHE,
+        help="sqlite file where the directory listings are cached between runs",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=0,
+        help="Minutes during which a cached directory listing is used. 0, the "
+        "default, disables the cache. Files added below the top directories can "
+        "be missed until the cached listings expire, so only use it on directories "
+        "that are not being written to.",
+    )
+
+
+def add_listing_arguments(parser):
+    """Add the options of find_root_files to the parser of a script"""
+    parser.add_argument(
+        "--allow_missing",
+        action="store_true",
+        help="Go on without the directories that cannot be listed, instead of "
+        "stopping. Their files are then left out.",
+    )
+
+
+def open_cache(args):
+    """The listing cache configured by the options of add_cache_arguments"""
+    if args.cache_ttl <= 0:
+        return None
+    return ListingCache(args.cache, args.cache_ttl * 60)
+
+
+def find_root_files(
+    backend,
+    directories,
+    workers=16,
+    skip=("log",),
+    verbose=False,
+    cache=None,
+    allow_missing=False,
+):
+    """
+    Find all .root files below each of the directories, listing every directory
+    exactly once. The directories of each level of the tree are listed in
+    parallel by a pool of workers. Subdirectories named as in skip are not
+    entered. The sizes of the files come with the listing, so they need no
+    further calls. Listings found in the cache (a ListingCache) are not listed
+    again. Returns a dictionary {directory: sorted list of
+    (.root file, size in bytes)}. Raises a StorageError if a directory cannot be
+    listed, unless allow_missing is set, in which case it is left out.
+    """
+    files = dict((directory, []) for directory in directories)
+    pool = ThreadPool(workers)
+    n_listed = 0
+    n_cached = 0
+    failed = []
+
+    # (top directory, directory to list, its modification time if known)
+    level = [(directory, directory, None) for directory in directories]
+    while level:
+        # The cache is only used from this thread
+        listings = [
+            cache.get(backend.redirector, directory, mtime) if cache else None
+            for _, directory, mtime in level
+        ]
+        missing = [i for i, listing in enumerate(listings) if listing is None]
+        fetched = pool.map(lambda i: list_directory(backend, level[i][1]), missing)
+        for i, listing in zip(missing, fetched):
+            listings[i] = listing
+            if cache and listing is not None:
+                cache.put(backend.redirector, level[i][1], level[i][2], listing)
+        n_listed += len(missing)
+        n_cached += len(level) - len(missing)
+
+        next_level = []
+        for (top, directory, _), listing in zip(level, listings):
+            if listing is None:
+                failed.append(directory)
+                continue
+            if verbose:
+                print("  Scanned {}".format(directory))
+            names, subdirectories = listing
+            files[top].extend(
+                (os.path.join(directory, name), size)
+                for name, size in names
+                if name.endswith(".root")
+            )
+            next_level.extend(
+                (top, os.path.join(directory, name), mtime)
+                for name, mtime in subdirectories
+                if name not in skip
+            )
+        level = next_level
+
+    pool.close()
+    pool.join()
+    if cache:
+        print(
+            "Listed {} directories, {} more from the cache".format(n_listed, n_cached)
+        )
+    if failed and not allow_missing:
+        raise StorageError(
+            "Cannot list {} directories: {}".format(len(failed), ", ".join(failed))
+        )
+    if failed:
+        print("  Warning: left out {} directories".format(len(failed)))
+    return dict((directory, sorted(found)) for directory, found in files.items())
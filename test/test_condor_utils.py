@@ -0,0 +1,67 @@
+"""
+Tests of the job planning helpers of condor_utils.py. Run them from this
+directory with python -m pytest test_condor_utils.py
+"""
+
+import unittest
+
+import condor_utils
+
+
+def get_totals(groups, sizes):
+    return [sum(sizes[f] for f in group) for group in groups]
+
+
+class GroupFilesTest(unittest.TestCase):
+    def test_uniform_sizes_are_balanced(self):
+        files = ["f{}".format(i) for i in range(10)]
+        sizes = dict((f, 30) for f in files)
+        groups = condor_utils.group_files(files, sizes, 100)
+        self.assertEqual(sorted(get_totals(groups, sizes)), [60, 60, 90, 90])
+
+    def test_greedy_fills_groups_in_order(self):
+        files = ["f{}".format(i) for i in range(10)]
+        sizes = dict((f, 30) for f in files)
+        groups = condor_utils.group_files(files, sizes, 100, packing="greedy")
+        self.assertEqual(get_totals(groups, sizes), [90, 90, 90, 30])
+
+    def test_all_files_once_and_below_max_size(self):
+        files = ["f{}".format(i) for i in range(50)]
+        sizes = dict((f, (i * 37) % 23 + 1) for i, f in enumerate(files))
+        groups = condor_utils.group_files(files, sizes, 40)
+        self.assertEqual(sorted(f for group in groups for f in group), sorted(files))
+        self.assertTrue(all(total <= 40 for total in get_totals(groups, sizes)))
+
+    def test_groups_keep_listing_order(self):
+        files = ["f{}".format(i) for i in range(7)]
+        sizes = dict(zip(files, [5, 40, 10, 35, 20, 25, 15]))
+        groups = condor_utils.group_files(files, sizes, 60)
+        for group in groups:
+            self.assertEqual(group, sorted(group, key=files.index))
+        self.assertEqual(groups, sorted(groups, key=lambda g: files.index(g[0])))
+
+    def test_large_file_gets_its_own_group(self):
+        files = ["small1", "large", "small2"]
+        sizes = {"small1": 10, "large": 250, "small2": 10}
+        groups = condor_utils.group_files(files, sizes, 100)
+        self.assertIn(["large"], groups)
+        self.assertIn(["small1", "small2"], groups)
+
+    def test_small_groups_are_merged(self):
+        files = ["a", "b", "c"]
+        sizes = {"a": 60, "b": 30, "c": 10}
+        groups = condor_utils.group_files(files, sizes, 100, min_fill=0.5)
+        self.assertEqual(groups, [["a", "b", "c"]])
+
+    def test_files_above_half_size_get_a_group_each(self):
+        files = ["f{}".format(i) for i in range(20000)]
+        sizes = dict((f, 53) for f in files)
+        groups = condor_utils.group_files(files, sizes, 100)
+        self.assertEqual(len(groups), len(files))
+
+    def test_no_files(self):
+        self.assertEqual(condor_utils.group_files([], {}, 100), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Tests of the job planning of merge.py, with an output directory on the local file
+system. Run them from this directory with python -m pytest test_merge.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import merge
+import storage
+
+
+class GetUsedIndicesTest(unittest.TestCase):
+    def test_merged_files_parts_and_manifests(self):
+        items = [
+            "merged_0.root",
+            "merged_0.json",
+            "merged_3_part1.root",
+            "merged_7.json",
+            "merged_x.root",
+            "other_9.root",
+            "merged_5.root.tmp",
+        ]
+        self.assertEqual(merge.get_used_indices(items), set([0, 3, 7]))
+
+    def test_no_files(self):
+        self.assertEqual(merge.get_used_indices([]), set())
+
+
+class PlanJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.args = argparse.Namespace(
+            incremental=True,
+            backend=storage.LocalBackend(),
+            output_size=None,
+            packing="balanced",
+            min_fill=0.5,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def add_merged(self, index, inputs, size, **extra):
+        manifest = dict(inputs=inputs, size=size, complete=True, **extra)
+        with open(
+            os.path.join(self.output_dir, "merged_{}.json".format(index)), "w"
+        ) as f:
+            json.dump(manifest, f)
+        open(os.path.join(self.output_dir, "merged_{}.root".format(index)), "w").close()
+
+    def merged(self, index):
+        return os.path.join(self.output_dir, "merged_{}.root".format(index))
+
+    def test_new_output_directory(self):
+        self.args.incremental = False
+        jobs = merge.plan_jobs(self.args, {"a": 60, "b": 60}, 100, self.output_dir)
+        self.assertEqual(sorted(jobs), [0, 1])
+        self.assertEqual(sorted(group for group, _ in jobs.values()), [["a"], ["b"]])
+
+    def test_merged_inputs_are_skipped(self):
+        self.add_merged(0, ["a", "b"], 90)
+        jobs = merge.plan_jobs(
+            self.args, {"a": 45, "b": 45, "c": 50}, 100, self.output_dir
+        )
+        self.assertEqual(jobs, {1: (["c"], {"inputs": ["c"], "size": 50})})
+
+    def test_append_writes_a_new_index(self):
+        self.add_merged(0, ["a"], 40)
+        jobs = merge.plan_jobs(self.args, {"a": 40, "b": 30}, 100, self.output_dir)
+        self.assertEqual(
+            jobs,
+            {
+                1: (
+                    [self.merged(0), "b"],
+                    {"inputs": ["a", "b"], "size": 70, "replaces": 0},
+                )
+            },
+        )
+
+    def test_new_index_after_files_without_manifest(self):
+        open(os.path.join(self.output_dir, "merged_4.root"), "w").close()
+        jobs = merge.plan_jobs(self.args, {"a": 40}, 100, self.output_dir)
+        self.assertEqual(sorted(jobs), [5])
+
+    def test_pending_and_replaced_files_are_not_appended_to(self):
+        self.add_merged(0, ["a"], 10)
+        self.add_merged(1, ["b"], 10)
+        self.add_merged(2, ["a", "c"], 20, replaces=0)
+        with open(os.path.join(self.output_dir, "merged_1.json"), "w") as f:
+            json.dump({"inputs": ["b"], "size": 10, "complete": False}, f)
+        jobs = merge.plan_jobs(
+            self.args, {"a": 5, "b": 5, "c": 5, "d": 5}, 100, self.output_dir
+        )
+        self.assertEqual(
+            jobs,
+            {
+                3: (
+                    [self.merged(2), "d"],
+                    {"inputs": ["a", "c", "d"], "size": 25, "replaces": 2},
+                )
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
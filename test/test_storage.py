@@ -0,0 +1,87 @@
+"""
+Tests of the directory crawl of storage.py, on the local file system. Run them
+from this directory with python -m pytest test_storage.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import storage
+
+
+class FailingBackend(storage.LocalBackend):
+    """Local backend that cannot list the given directories"""
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    def list_directory(self, directory):
+        if directory in self.failing:
+            raise storage.StorageError("Cannot list {}".format(directory))
+        return storage.LocalBackend.list_directory(self, directory)
+
+
+class FindRootFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        for path, size in [
+            ("a/one.root", 10),
+            ("a/sub/two.root", 20),
+            ("a/notes.txt", 5),
+            ("a/log/three.root", 30),
+            ("b/deep/er/four.root", 40),
+        ]:
+            path = os.path.join(self.top, path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+        self.dirs = [os.path.join(self.top, "a"), os.path.join(self.top, "b")]
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def test_finds_root_files_with_sizes(self):
+        found = storage.find_root_files(storage.LocalBackend(), self.dirs, workers=2)
+        self.assertEqual(
+            found[self.dirs[0]],
+            [
+                (os.path.join(self.dirs[0], "one.root"), 10),
+                (os.path.join(self.dirs[0], "sub", "two.root"), 20),
+            ],
+        )
+        self.assertEqual(
+            found[self.dirs[1]],
+            [(os.path.join(self.dirs[1], "deep", "er", "four.root"), 40)],
+        )
+
+    def test_unlistable_directory_raises(self):
+        backend = FailingBackend([os.path.join(self.dirs[0], "sub")])
+        with self.assertRaises(storage.StorageError):
+            storage.find_root_files(backend, self.dirs, workers=2)
+
+    def test_unlistable_directory_left_out_when_allowed(self):
+        backend = FailingBackend([os.path.join(self.dirs[0], "sub")])
+        found = storage.find_root_files(
+            backend, self.dirs, workers=2, allow_missing=True
+        )
+        self.assertEqual(
+            found[self.dirs[0]], [(os.path.join(self.dirs[0], "one.root"), 10)]
+        )
+        self.assertEqual(len(found[self.dirs[1]]), 1)
+
+    def test_cached_listings_are_reused(self):
+        cache = storage.ListingCache(os.path.join(self.top, "cache.sqlite"), 3600)
+        storage.find_root_files(storage.LocalBackend(), self.dirs, cache=cache)
+        # Below the top directories, listings come from the cache while the
+        # modification time of the directory is the same
+        backend = FailingBackend([os.path.join(self.dirs[0], "sub")])
+        found = storage.find_root_files(backend, self.dirs, cache=cache)
+        cache.close()
+        self.assertEqual(len(found[self.dirs[0]]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+"""
+Check a file merged with haddnano.py against its inputs, using only file and
+tree metadata: the Events baskets are never read. The output must be complete
+(not truncated or recovered), every tree must have as many entries as in all
+inputs together, and the event counts and sums of weights of the Runs tree must
+add up to the ones of the inputs.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import ROOT  # type: ignore [import]
+
+# Runs branches whose sum over all entries must be the same before and after merging
+SUMMED_RUNS_BRANCHES = ("genEventCount", "genEventSumw")
+
+ROOT.gInterpreter.Declare(
+    """
+Long64_t verify_merge_basket_end(TTree* tree) {
+    // Largest file offset used by the baskets of the tree, from the branch headers
+    Long64_t end = 0;
+    TIter next(tree->GetListOfLeaves());
+    while (TLeaf* leaf = (TLeaf*)next()) {
+        TBranch* branch = leaf->GetBranch();
+        Long64_t* seeks = branch->GetBasketSeek();
+        Int_t* bytes = branch->GetBasketBytes();
+        for (Int_t i = 0; i < branch->GetWriteBasket(); ++i)
+            end = std::max(end, seeks[i] + bytes[i]);
+    }
+    return end;
+}
+"""
+)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Check a merged file against its inputs using only metadata"
+    )
+    parser.add_argument("output", type=str, help="Merged file")
+    parser.add_argument("inputs", type=str, nargs="+", help="Input files of the merge")
+    parser.add_argument(
+        "--reduce-runs",
+        action="store_true",
+        help="The merge was done with haddnano.py --reduce-runs, so the Runs tree "
+        "can have fewer entries than the inputs together",
+    )
+    parser.add_argument(
+        "--parts",
+        action="store_true",
+        help="The merge was done with haddnano.py --max-output-size: check all the "
+        "<output>_part<K>.root files together against the inputs",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-6,
+        help="Relative tolerance when comparing sums of weights",
+    )
+    return parser.parse_args()
+
+
+def open_file(path, errors):
+    """Open a file, recording an error if it is unreadable or was not closed properly"""
+    file_handle = ROOT.TFile.Open(path)
+    if not file_handle or file_handle.IsZombie():
+        errors.append("Cannot open {}".format(path))
+        return None
+    if file_handle.TestBit(ROOT.TFile.kRecovered):
+        errors.append("{} was not closed properly and had to be recovered".format(path))
+    return file_handle
+
+
+def get_trees(file_handle):
+    """
+    Trees in a file, reading only their headers. Trees filled entry by entry keep
+    the backup cycles saved while they were written, so only the highest cycle of
+    each tree is read.
+    """
+    keys = {}
+    for key in file_handle.GetListOfKeys():
+        if ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom(ROOT.TTree.Class()):
+            name = key.GetName()
+            if name not in keys or key.GetCycle() > keys[name].GetCycle():
+                keys[name] = key
+    return dict((name, key.ReadObj()) for name, key in keys.items())
+
+
+def get_runs_sums(tree):
+    """Sum over all entries of the event count and sum of weights branches"""
+    leaves = [
+        br.GetLeaf(br.GetName())
+        for br in tree.GetListOfBranches()
+        if br.GetName().startswith(SUMMED_RUNS_BRANCHES)
+    ]
+    tree.SetBranchStatus("*", 0)
+    for leaf in leaves:
+        tree.SetBranchStatus(leaf.GetName(), 1)
+    sums = dict((leaf.GetName(), 0.0) for leaf in leaves)
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        for leaf in leaves:
+            sums[leaf.GetName()] += leaf.GetValue()
+    return sums
+
+
+def check_complete(file_handle, trees, errors):
+    """Check that the file and the baskets of its trees are not truncated"""
+    if file_handle.GetEND() > file_handle.GetSize():
+        errors.append(
+            "{} is truncated: it should have {} bytes but has {}".format(
+                file_handle.GetName(), file_handle.GetEND(), file_handle.GetSize()
+            )
+        )
+    for name, tree in trees.items():
+        end = ROOT.verify_merge_basket_end(tree)
+        if end > file_handle.GetSize():
+            errors.append(
+                "Tree {} of {} has baskets beyond the end of the file".format(
+                    name, file_handle.GetName()
+                )
+            )
+
+
+def get_outputs(args):
+    """The merged file, or all its parts with --parts"""
+    if not args.parts:
+        return [args.output]
+    stem, extension = os.path.splitext(args.output)
+    return sorted(glob.glob("{}_part*{}".format(stem, extension)))
+
+
+def verify(args):
+    """Return the list of problems found, empty if the merged files are fine"""
+    errors = []
+
+    output_paths = get_outputs(args)
+    if not output_paths:
+        return ["No parts of {} found".format(args.output)]
+    output_files = []
+    output_entries = {}
+    output_sums = {}
+    for path in output_paths:
+        output_file = open_file(path, errors)
+        if not output_file:
+            return errors
+        output_files.append(output_file)
+        output_trees = get_trees(output_file)
+        check_complete(output_file, output_trees, errors)
+        for name, tree in output_trees.items():
+            output_entries[name] = output_entries.get(name, 0) + tree.GetEntries()
+            if name == "Runs":
+                for branch, value in get_runs_sums(tree).items():
+                    output_sums[branch] = output_sums.get(branch, 0.0) + value
+
+    entries = dict((name, 0) for name in output_entries)
+    runs_sums = {}
+    for path in args.inputs:
+        input_file = open_file(path, errors)
+        if not input_file:
+            continue
+        for name, tree in get_trees(input_file).items():
+            if name not in entries:
+                errors.append(
+                    "Tree {} of {} is missing in the output".format(name, path)
+                )
+                continue
+            entries[name] += tree.GetEntries()
+            if name == "Runs":
+                for branch, value in get_runs_sums(tree).items():
+                    runs_sums[branch] = runs_sums.get(branch, 0.0) + value
+        input_file.Close()
+
+    for name, n_entries in output_entries.items():
+        if name == "Runs" and args.reduce_runs:
+            continue
+        if n_entries != entries[name]:
+            errors.append(
+                "Tree {} has {} entries but the inputs have {}".format(
+                    name, n_entries, entries[name]
+                )
+            )
+
+    if "Runs" in output_entries:
+        for branch, value in sorted(runs_sums.items()):
+            output_value = output_sums.get(branch)
+            if output_value is None:
+                if value:
+                    errors.append(
+                        "Runs branch {} is missing in the output".format(branch)
+                    )
+            elif abs(output_value - value) > args.tolerance * max(abs(value), 1.0):
+                errors.append(
+                    "Runs branch {} sums to {} but the inputs sum to {}".format(
+                        branch, output_value, value
+                    )
+                )
+
+    for output_file in output_files:
+        output_file.Close()
+    return errors
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    errors = verify(args)
+    if errors:
+        print("Verification of {} failed:".format(args.output))
+        for error in errors:
+            print("  " + error)
+        sys.exit(1)
+    print("Verified {} against {} inputs".format(args.output, len(args.inputs)))